@@ -14,7 +14,7 @@ class ItemConfigSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ItemConfig
-        fields = ["event", "days", "second_item", "max_days"]
+        fields = ["event", "days", "second_item", "max_days", "strategy"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
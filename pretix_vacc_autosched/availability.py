@@ -0,0 +1,452 @@
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils.timezone import now
+from pretix.base.models import Quota
+from pretix.base.services.quotas import QuotaAvailability
+
+from pretix_vacc_autosched.models import CapacityToken, ItemConfig, SlotAvailability
+
+logger = logging.getLogger(__name__)
+
+# Rows are refreshed through signals, but those are only sent for events that have the
+# plugin enabled. To bound the drift for target series without the plugin, rows older
+# than this are recomputed on read.
+INDEX_MAX_AGE = timedelta(minutes=15)
+
+# How long concurrent requests wait for another request computing the same availability
+SINGLE_FLIGHT_WAIT = 5
+
+
+def compute_slot_availability(subevents, item, variation):
+    """
+    Computes the availability of ``item`` (or ``variation``) in all of ``subevents`` in one
+    batch and stores the result in the index. Returns a dictionary mapping subevent IDs to
+    the new ``SlotAvailability`` rows.
+    """
+    subevents = list(subevents)
+    quotas = Quota.objects.filter(subevent__in=subevents, items=item).select_related(
+        "event"
+    )
+    if variation:
+        quotas = quotas.filter(variations=variation)
+    quotas = list(quotas)
+
+    qa = QuotaAvailability()
+    qa.queue(*quotas)
+    qa.compute()
+
+    quotas_by_subevent = {}
+    for q in quotas:
+        quotas_by_subevent.setdefault(q.subevent_id, []).append(q)
+
+    rows = {}
+    computed = now()
+    for subevent in subevents:
+        results = [(q, qa.results[q]) for q in quotas_by_subevent.get(subevent.pk, [])]
+        size = None
+        if not results:
+            availability, number = Quota.AVAILABILITY_GONE, 0
+        else:
+            availability = min(r[0] for q, r in results)
+            limited = [(r[1], q.size) for q, r in results if r[1] is not None]
+            if limited:
+                number, size = min(limited)
+                number = max(number, 0)
+            else:
+                number = None
+        rows[subevent.pk] = SlotAvailability(
+            event_id=subevent.event_id,
+            item=item,
+            variation=variation,
+            subevent=subevent,
+            availability=availability,
+            available_number=number,
+            size=size,
+            computed=computed,
+        )
+
+    try:
+        with transaction.atomic():
+            SlotAvailability.objects.filter(
+                item=item, variation=variation, subevent__in=subevents
+            ).delete()
+            SlotAvailability.objects.bulk_create(rows.values())
+    except IntegrityError:
+        # A concurrent refresh stored the same slots, its result is just as recent.
+        logger.info("SECOND DOSE: concurrent availability refresh, skipping")
+    return rows
+
+
+def store_slot_availability(subevent, item, variation, availability, number):
+    """
+    Updates the indexed availability of a single slot with a result that is already known,
+    e.g. from a quota check performed while booking.
+    """
+    SlotAvailability.objects.filter(
+        item=item, variation=variation, subevent=subevent
+    ).update(
+        availability=availability,
+        available_number=max(number, 0) if number is not None else None,
+        computed=now(),
+    )
+
+
+def refresh_slot_availability(event, subevent_ids):
+    """
+    Recomputes all indexed rows of the given subevents, for every product that has been
+    looked up in them before.
+    """
+    rows = SlotAvailability.objects.filter(
+        event=event, subevent_id__in=subevent_ids
+    ).select_related("item", "variation", "subevent")
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.item, row.variation), []).append(row.subevent)
+    for (item, variation), subevents in groups.items():
+        compute_slot_availability(subevents, item, variation)
+
+
+def get_slot_availability(subevents, item, variation):
+    """
+    Returns the indexed availability of ``item`` (or ``variation``, if given) in each of
+    ``subevents`` as a dictionary mapping subevent IDs to ``SlotAvailability`` rows. Only
+    slots that have not been indexed yet or whose entry is outdated are computed, in one
+    batch.
+    """
+    subevents = list(subevents)
+    rows = {
+        r.subevent_id: r
+        for r in SlotAvailability.objects.filter(
+            item=item,
+            variation=variation,
+            subevent__in=subevents,
+            computed__gte=now() - INDEX_MAX_AGE,
+        )
+    }
+    missing = [s for s in subevents if s.pk not in rows]
+    if missing:
+        rows.update(compute_slot_availability(missing, item, variation))
+    return rows
+
+
+def cached_availability(key, ttl, compute):
+    """
+    Returns the result of ``compute`` cached under ``key`` for ``ttl`` seconds. Of many
+    concurrent requests that miss the cache, only one computes the result while the others
+    wait for it, up to ``SINGLE_FLIGHT_WAIT`` seconds.
+    """
+    if not ttl:
+        return compute()
+    key = f"vacc_autosched:availability:{key}"
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    if cache.add(f"{key}:lock", True, SINGLE_FLIGHT_WAIT):
+        try:
+            value = compute()
+            cache.set(key, value, ttl)
+        finally:
+            cache.delete(f"{key}:lock")
+        return value
+
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    # The computing request took too long or failed
+    return compute()
+
+
+def get_available_days(subevents, item, variation):
+    """
+    Returns the sorted list of days on which ``item`` (or ``variation``) is available in
+    at least one of ``subevents``, a queryset. Slots that have not been indexed yet or
+    whose entry is outdated are computed first, the days are then aggregated from the
+    index in the database.
+    """
+    fresh = SlotAvailability.objects.filter(
+        item=item,
+        variation=variation,
+        subevent__in=subevents,
+        computed__gte=now() - INDEX_MAX_AGE,
+    )
+    missing = list(subevents.exclude(pk__in=fresh.values("subevent")))
+    if missing:
+        compute_slot_availability(missing, item, variation)
+
+    return list(
+        fresh.filter(availability=Quota.AVAILABILITY_OK)
+        .annotate(day=TruncDate("subevent__date_from"))
+        .values_list("day", flat=True)
+        .distinct()
+        .order_by("day")
+    )
+
+
+def get_available_subevents(subevents, item, variation):
+    """
+    Filters ``subevents`` down to the ones in which ``item`` (or ``variation``, if given) is
+    currently available according to the index, keeping their order. Subevents without any
+    quota for the product are never considered available.
+    """
+    subevents = list(subevents)
+    rows = get_slot_availability(subevents, item, variation)
+    return [
+        subevent
+        for subevent in subevents
+        if rows[subevent.pk].availability == Quota.AVAILABILITY_OK
+    ]
+
+
+def order_by_strategy(subevents, itemconf, earliest_date, fill_level):
+    """
+    Orders candidate slots, sorted by date, by the slot selection strategy of ``itemconf``.
+    All strategies but the earliest slot order the slots within the window between ``days``
+    and ``max_days`` after the first dose and fall back to the later ones by date.
+    ``fill_level`` is called with a subevent and returns the share of its seats that is
+    taken, from 0 to 1, so that slots of different sizes are filled evenly.
+    """
+    if itemconf.strategy == ItemConfig.STRATEGY_EARLIEST:
+        return list(subevents)
+
+    tz = earliest_date.tzinfo
+    window_end = earliest_date.date() + timedelta(
+        days=max((itemconf.max_days or 0) - itemconf.days, 0)
+    )
+    window, later = [], []
+    for s in subevents:
+        (window if s.date_from.astimezone(tz).date() <= window_end else later).append(s)
+
+    if itemconf.strategy == ItemConfig.STRATEGY_TIME:
+
+        def minutes(dt):
+            dt = dt.astimezone(tz)
+            return dt.hour * 60 + dt.minute
+
+        window.sort(key=lambda s: abs(minutes(s.date_from) - minutes(earliest_date)))
+    elif itemconf.strategy == ItemConfig.STRATEGY_LEAST_FILLED:
+        window.sort(key=fill_level)
+    elif itemconf.strategy == ItemConfig.STRATEGY_RANDOM:
+        random.shuffle(window)
+    return window + later
+
+
+class SlotCapacity:
+    """
+    In-memory model of the remaining quota capacity in a set of subevents, used to assign
+    many bookings while holding the locks of the quotas involved. The quotas are loaded on
+    creation so they can be locked, ``compute`` then runs one batched availability
+    computation. The model is updated as slots are taken, so quotas shared between products
+    or variations are accounted for correctly.
+    """
+
+    def __init__(self, subevents, products):
+        items = {item for item, variation in products if not variation}
+        variations = {variation for item, variation in products if variation}
+        self.quota_objects = list(
+            Quota.objects.filter(subevent__in=subevents)
+            .filter(Q(items__in=items) | Q(variations__in=variations))
+            .distinct()
+            .select_related("event")
+            .prefetch_related("items", "variations")
+        )
+        self.quota_objects_by_pk = {q.pk: q for q in self.quota_objects}
+        self.remaining = {}
+        self.sizes = {q.pk: q.size for q in self.quota_objects}
+        self.quotas = defaultdict(list)
+        self.touched = set()
+
+    def compute(self):
+        qa = QuotaAvailability()
+        qa.queue(*self.quota_objects)
+        qa.compute()
+
+        for q in self.quota_objects:
+            availability, number = qa.results[q]
+            if availability != Quota.AVAILABILITY_OK:
+                self.remaining[q.pk] = 0
+            else:
+                self.remaining[q.pk] = number
+            for item in q.items.all():
+                self.quotas[item.pk, None, q.subevent_id].append(q.pk)
+            for variation in q.variations.all():
+                self.quotas[variation.item_id, variation.pk, q.subevent_id].append(q.pk)
+
+    def _quotas(self, subevent, item, variation):
+        return self.quotas.get(
+            (item.pk, variation.pk if variation else None, subevent.pk), []
+        )
+
+    def get_quotas(self, subevent, item, variation):
+        return [
+            self.quota_objects_by_pk[q] for q in self._quotas(subevent, item, variation)
+        ]
+
+    def availability(self, subevent, item, variation):
+        numbers = [
+            self.remaining[q]
+            for q in self._quotas(subevent, item, variation)
+            if self.remaining[q] is not None
+        ]
+        if not self._quotas(subevent, item, variation):
+            return Quota.AVAILABILITY_GONE, 0
+        if not numbers:
+            return Quota.AVAILABILITY_OK, None
+        number = min(numbers)
+        return (
+            Quota.AVAILABILITY_OK if number > 0 else Quota.AVAILABILITY_GONE,
+            number,
+        )
+
+    def fill_level(self, subevent, item, variation):
+        """
+        Returns the share of the seats of ``item``/``variation`` in ``subevent`` that is
+        taken, from 0 to 1, according to the fullest of its quotas.
+        """
+        quotas = self._quotas(subevent, item, variation)
+        if not quotas:
+            return 1.0
+        levels = [
+            1 - self.remaining[q] / self.sizes[q] if self.sizes[q] else 1.0
+            for q in quotas
+            if self.remaining[q] is not None
+        ]
+        return max(levels, default=0.0)
+
+    def take(self, subevent, item, variation):
+        """
+        Reserves one unit of ``item``/``variation`` in ``subevent`` if it is available and
+        returns whether it was.
+        """
+        availability, number = self.availability(subevent, item, variation)
+        if availability != Quota.AVAILABILITY_OK:
+            return False
+        for q in self._quotas(subevent, item, variation):
+            if self.remaining[q] is not None:
+                self.remaining[q] -= 1
+        self.touched.add((item, variation, subevent))
+        return True
+
+
+def uses_capacity_pool(event):
+    """
+    Whether bookings configured in ``event`` claim seats from the capacity pool instead of
+    locking and checking the quotas. The pool relies on ``SELECT ... FOR UPDATE SKIP
+    LOCKED``, on databases without it (SQLite) it is never used.
+    """
+    return (
+        event.settings.vacc_autosched_token_pool
+        and connection.features.has_select_for_update_skip_locked
+    )
+
+
+def get_pooled_quotas(quotas):
+    """
+    Returns the IDs of those of ``quotas`` that have a capacity pool. Quotas get a pool
+    when they are reconciled for the first time, until then their bookings check them.
+    """
+    return set(
+        CapacityToken.objects.filter(quota__in=quotas)
+        .values_list("quota", flat=True)
+        .distinct()
+    )
+
+
+def claim_capacity_tokens(quotas):
+    """
+    Claims a free seat from the capacity pool of each of ``quotas`` that has a size,
+    skipping seats that are being claimed by concurrent bookings instead of waiting for
+    them. Must be called inside a transaction, the seats are released again if the
+    transaction is rolled back. Returns the claimed tokens, or ``None`` if one of the
+    quotas is closed or has no free seat left.
+    """
+    tokens = []
+    for quota in sorted(quotas, key=lambda q: q.pk):
+        if quota.closed:
+            return None
+        if quota.size is None:
+            continue
+        token = (
+            CapacityToken.objects.select_for_update(skip_locked=True)
+            .filter(quota=quota, link__isnull=True)
+            .order_by("pk")
+            .first()
+        )
+        if token is None:
+            return None
+        tokens.append(token)
+    return tokens
+
+
+def get_pool_availability(quotas):
+    """
+    Returns the availability of a slot with ``quotas`` according to their capacity pools,
+    as a tuple of the availability code and the number of free seats, like
+    ``Item.check_quotas``.
+    """
+    limited = [q.pk for q in quotas if q.size is not None]
+    if not limited:
+        return Quota.AVAILABILITY_OK, None
+    free = dict(
+        CapacityToken.objects.filter(quota__in=limited, link__isnull=True)
+        .values("quota")
+        .annotate(c=Count("id"))
+        .values_list("quota", "c")
+    )
+    number = min(free.get(q, 0) for q in limited)
+    return (
+        Quota.AVAILABILITY_OK if number > 0 else Quota.AVAILABILITY_GONE,
+        number,
+    )
+
+
+def reconcile_capacity_tokens(quotas):
+    """
+    Brings the number of free tokens in the capacity pool of each of ``quotas`` in line
+    with its remaining capacity. Booked seats are already counted by the quota, so the
+    number of free tokens should equal the number of available seats. Surplus tokens that
+    are currently being claimed are left alone. Quotas without a size need no pool.
+    """
+    quotas = [q for q in quotas if q.size is not None]
+    qa = QuotaAvailability()
+    qa.queue(*quotas)
+    qa.compute()
+    free = dict(
+        CapacityToken.objects.filter(quota__in=quotas, link__isnull=True)
+        .values("quota")
+        .annotate(c=Count("id"))
+        .values_list("quota", "c")
+    )
+
+    create = []
+    surplus = {}
+    for quota in quotas:
+        availability, number = qa.results[quota]
+        target = max(number, 0) if availability == Quota.AVAILABILITY_OK else 0
+        diff = target - free.get(quota.pk, 0)
+        if diff > 0:
+            create += [CapacityToken(quota=quota) for i in range(diff)]
+        elif diff < 0:
+            surplus[quota.pk] = -diff
+
+    CapacityToken.objects.bulk_create(create)
+    for quota_id, number in surplus.items():
+        with transaction.atomic():
+            ids = list(
+                CapacityToken.objects.select_for_update(
+                    skip_locked=connection.features.has_select_for_update_skip_locked
+                )
+                .filter(quota_id=quota_id, link__isnull=True)
+                .values_list("pk", flat=True)[:number]
+            )
+            CapacityToken.objects.filter(pk__in=ids).delete()
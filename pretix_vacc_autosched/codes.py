@@ -0,0 +1,77 @@
+from django.db import transaction
+from pretix.base.models import Order
+
+from pretix_vacc_autosched.models import CodeLookup
+
+
+def normalize_code(code):
+    return code.strip().lower()
+
+
+def update_code_lookup(orders):
+    """
+    Replaces the lookup rows of ``orders`` with rows for their current code, secret and
+    position secrets.
+    """
+    orders = list(orders)
+    rows = []
+    for order in orders:
+        rows.append(
+            CodeLookup(
+                event_id=order.event_id, code=normalize_code(order.code), order=order
+            )
+        )
+        rows.append(
+            CodeLookup(
+                event_id=order.event_id, code=normalize_code(order.secret), order=order
+            )
+        )
+        for position in order.all_positions.all():
+            rows.append(
+                CodeLookup(
+                    event_id=order.event_id,
+                    code=normalize_code(position.secret),
+                    order=order,
+                    position=position,
+                )
+            )
+    with transaction.atomic():
+        CodeLookup.objects.filter(order__in=orders).delete()
+        CodeLookup.objects.bulk_create(rows)
+
+
+def build_code_lookup(event, batch_size=5000):
+    """
+    Adds all existing orders of ``event`` to the lookup table and marks the event as
+    backfilled. New orders are added through signals, so afterwards the self-service form
+    no longer needs to search the orders directly. Returns the number of orders.
+    """
+    qs = event.orders.prefetch_related("all_positions").order_by("pk")
+    count = 0
+    last_pk = 0
+    while True:
+        batch = list(qs.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        update_code_lookup(batch)
+        count += len(batch)
+        last_pk = batch[-1].pk
+    event.settings.vacc_autosched_codes_backfilled = True
+    return count
+
+
+def find_order(event, code):
+    """
+    Returns the paid order of ``event`` with the given order code, order secret or
+    position secret, ignoring case, or ``None``.
+    """
+    lookup = (
+        CodeLookup.objects.filter(
+            event=event,
+            code=normalize_code(code),
+            order__status=Order.STATUS_PAID,
+        )
+        .select_related("order")
+        .first()
+    )
+    return lookup.order if lookup else None
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
 from django.utils.formats import date_format
 from django.utils.translation import gettext_lazy as _
 from django_scopes.forms import SafeModelChoiceField
@@ -8,7 +10,10 @@ from pretix.base.email import get_available_placeholders
 from pretix.base.forms import PlaceholderValidator, SettingsForm
 from pretix.base.models import Item, Order
 
+from .availability import get_available_subevents
+from .codes import find_order
 from .models import ItemConfig, LinkedOrderPosition
+from .products import find_items_by_name
 
 
 def can_use_juvare_api(event):
@@ -32,7 +37,7 @@ class ForeignKeyRawIdWidget(forms.TextInput):
 class ItemConfigForm(forms.ModelForm):
     class Meta:
         model = ItemConfig
-        fields = ["days", "max_days", "event", "second_item"]
+        fields = ["days", "max_days", "event", "second_item", "strategy"]
         widgets = {"second_item": ForeignKeyRawIdWidget}
         exclude = []
         field_classes = {
@@ -68,20 +73,7 @@ class ItemConfigForm(forms.ModelForm):
                     _("The product ID you entered is for the wrong event.")
                 )
         elif target_event != self.event:
-            has_item = (
-                len(
-                    [
-                        n
-                        for n in target_event.items.all()
-                        if (n.internal_name or str(n.name))
-                        == (
-                            self.instance.item.internal_name
-                            or str(self.instance.item.name)
-                        )
-                    ]
-                )
-                == 1
-            )
+            has_item = len(find_items_by_name(target_event, self.instance.item)) == 1
             if not has_item:
                 raise ValidationError(
                     _(
@@ -106,6 +98,40 @@ class AutoschedSettingsForm(SettingsForm):
         label=_("Auto-schedule second dose after check-in"),
         required=False,
     )
+    vacc_autosched_batch = forms.BooleanField(
+        label=_("Schedule check-ins in batches"),
+        help_text=_(
+            "Check-ins are collected and scheduled together, which reduces load on busy days. "
+            "The second dose is then booked up to the configured interval after check-in."
+        ),
+        required=False,
+    )
+    vacc_autosched_batch_interval = forms.IntegerField(
+        label=_("Batch interval"),
+        help_text=_(
+            "Maximum number of seconds a check-in waits before it is scheduled."
+        ),
+        min_value=1,
+        required=True,
+    )
+    vacc_autosched_batch_size = forms.IntegerField(
+        label=_("Batch size"),
+        help_text=_(
+            "A batch is scheduled right away once this many check-ins are waiting."
+        ),
+        min_value=1,
+        required=True,
+    )
+    vacc_autosched_token_pool = forms.BooleanField(
+        label=_("Book second doses from a capacity pool"),
+        help_text=_(
+            "The free seats of every upcoming second-dose slot are kept as a pool, so bookings claim a seat "
+            "without locking and checking the quotas, and skip full slots without waiting for each other. "
+            "The pool is reconciled with the quotas whenever other orders of a slot change and periodically. "
+            "Slots without a pool yet are booked by checking their quotas. Requires PostgreSQL."
+        ),
+        required=False,
+    )
     vacc_autosched_mail = forms.BooleanField(
         label=_("Send email if second dose has been scheduled"),
         required=False,
@@ -156,6 +182,33 @@ class AutoschedSettingsForm(SettingsForm):
         required=False,
         widget=I18nTextarea,
     )
+    vacc_autosched_self_service_cache_ttl = forms.IntegerField(
+        label=_("Self service availability cache"),
+        help_text=_(
+            "Number of seconds the available days and time slots shown in the self-service are reused for. "
+            "Bookings always check availability again. Set to 0 to turn caching off."
+        ),
+        min_value=0,
+        required=True,
+    )
+    vacc_autosched_waiting_room_rate = forms.IntegerField(
+        label=_("Self service admission rate"),
+        help_text=_(
+            "Number of visitors per second that are let through to the self-service pages. "
+            "Everyone else is shown their position in a queue until it is their turn. "
+            "Set to 0 to let everyone through right away."
+        ),
+        min_value=0,
+        required=True,
+    )
+    vacc_autosched_self_service_async = forms.BooleanField(
+        label=_("Book self service appointments in the background"),
+        help_text=_(
+            "Customers are shown a waiting page while their appointment is booked instead of "
+            "waiting for the booking to finish on the booking page."
+        ),
+        required=False,
+    )
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -195,12 +248,19 @@ class SecondDoseCodeForm(forms.Form):
 
     def clean_order(self):
         code = self.cleaned_data.get("order")
-        qs = self.event.orders.filter(status=Order.STATUS_PAID)
-        order = qs.filter(code__iexact=code).first()
-        if not order:
-            order = qs.filter(secret__iexact=code).first()
-        if not order:
-            order = qs.filter(all_positions__secret__iexact=code).first()
+        order = find_order(self.event, code)
+        if not order and not self.event.settings.vacc_autosched_codes_backfilled:
+            # The lookup table may not contain all orders of this event yet
+            if cache.add(f"vacc_autosched:backfill:{self.event.pk}", True, 3600):
+                from .tasks import backfill_code_lookup
+
+                backfill_code_lookup.apply_async(args=(self.event.pk,))
+            qs = self.event.orders.filter(status=Order.STATUS_PAID)
+            order = qs.filter(code__iexact=code).first()
+            if not order:
+                order = qs.filter(secret__iexact=code).first()
+            if not order:
+                order = qs.filter(all_positions__secret__iexact=code).first()
 
         if not order:
             raise forms.ValidationError(
@@ -209,7 +269,16 @@ class SecondDoseCodeForm(forms.Form):
                 )
             )
 
-        positions = list(order.positions.all())
+        positions = list(
+            order.positions.prefetch_related(
+                Prefetch(
+                    "vacc_autosched_linked",
+                    queryset=LinkedOrderPosition.objects.select_related(
+                        "child_position__subevent"
+                    ),
+                )
+            )
+        )
 
         if len(positions) != 1:
             raise forms.ValidationError(
@@ -220,7 +289,7 @@ class SecondDoseCodeForm(forms.Form):
 
         position = positions[0]
 
-        lop = LinkedOrderPosition.objects.filter(base_position=position).first()
+        lop = next(iter(position.vacc_autosched_linked.all()), None)
         if lop:
             raise forms.ValidationError(
                 _(
@@ -240,15 +309,22 @@ class SecondDoseCodeForm(forms.Form):
 
 
 class SecondDoseOrderForm(forms.Form):
-    def __init__(self, *args, position, available_subevents, event, **kwargs):
+    subevent = forms.IntegerField(widget=forms.HiddenInput, label=_("Date"))
+
+    def __init__(self, *args, position, subevents, item, variation, **kwargs):
         self.position = position
+        self.subevents = subevents
+        self.item = item
+        self.variation = variation
         super().__init__(*args, **kwargs)
 
-        self.subevents = available_subevents
-        self.fields["subevent"] = forms.ModelChoiceField(
-            queryset=event.subevents.filter(
-                pk__in=[e.pk for e in available_subevents]
-            ).order_by("date_from"),
-            label=_("Date"),
-            widget=forms.RadioSelect,
-        )
+    def clean_subevent(self):
+        # Only the chosen time slot is loaded and checked, not all slots it was chosen from
+        subevent = self.subevents.filter(pk=self.cleaned_data["subevent"]).first()
+        if not subevent or not get_available_subevents(
+            [subevent], self.item, self.variation
+        ):
+            raise forms.ValidationError(
+                _("This time slot is no longer available, please choose another one.")
+            )
+        return subevent
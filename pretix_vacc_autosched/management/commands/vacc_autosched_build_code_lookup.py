@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from pretix_vacc_autosched.codes import build_code_lookup
+
+
+class Command(BaseCommand):
+    help = "Build the lookup table of order codes and secrets used by the self-service form"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--event",
+            dest="events",
+            type=int,
+            action="append",
+            help="ID of an event to build the table for. Defaults to all events with the plugin enabled.",
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if options["events"]:
+            events = Event.objects.filter(pk__in=options["events"])
+        else:
+            events = Event.objects.filter(plugins__contains="pretix_vacc_autosched")
+
+        t = 0
+        for event in events:
+            t += build_code_lookup(event)
+
+        self.stderr.write(self.style.SUCCESS(f"Built the code lookup for {t} orders."))
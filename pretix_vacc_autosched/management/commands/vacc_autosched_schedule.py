@@ -0,0 +1,48 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition
+
+from pretix_vacc_autosched.routing import scheduling_options
+from pretix_vacc_autosched.tasks import schedule_second_doses
+
+
+class Command(BaseCommand):
+    help = "Schedule the second dose for a list of order positions in one batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "positions",
+            nargs="+",
+            type=int,
+            help="IDs of the order positions of the first dose",
+        )
+        parser.add_argument(
+            "--async",
+            dest="run_async",
+            action="store_true",
+            help="Queue the batch as a background task instead of running it right away.",
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        positions_by_event = defaultdict(list)
+        for event_id, target_event_id, pk in OrderPosition.objects.filter(
+            pk__in=options["positions"]
+        ).values_list("order__event_id", "item__vacc_autosched_config__event", "pk"):
+            positions_by_event[event_id, target_event_id or event_id].append(pk)
+
+        for (event_id, target_event_id), positions in positions_by_event.items():
+            if options["run_async"]:
+                schedule_second_doses.apply_async(
+                    args=(event_id, positions), **scheduling_options(target_event_id)
+                )
+            else:
+                schedule_second_doses.apply(args=(event_id, positions), throw=True)
+
+        self.stderr.write(
+            self.style.SUCCESS(
+                f"Scheduled {sum(len(p) for p in positions_by_event.values())} positions "
+                f"in {len({e for e, t in positions_by_event})} events."
+            )
+        )
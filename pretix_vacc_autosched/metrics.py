@@ -0,0 +1,96 @@
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from pretix.base.metrics import Counter, Histogram
+
+from pretix_vacc_autosched.tracing import span
+
+OUTCOME_SCHEDULED = "scheduled"
+OUTCOME_SOLD_OUT = "sold_out"
+OUTCOME_NO_PRODUCT = "no_product"
+OUTCOME_LOCK_TIMEOUT = "lock_timeout"
+OUTCOME_ALREADY_SCHEDULED = "already_scheduled"
+
+# Metrics are stored in pretix' metrics store and served by its /metrics endpoint
+vacc_autosched_phase_duration_seconds = Histogram(
+    "pretix_vacc_autosched_phase_duration_seconds",
+    "Time spent in each phase of scheduling and booking a second dose.",
+    ["event", "phase"],
+)
+vacc_autosched_scheduling_duration_seconds = Histogram(
+    "pretix_vacc_autosched_scheduling_duration_seconds",
+    "Time needed to schedule the second dose of a position.",
+    ["event", "outcome"],
+)
+vacc_autosched_scheduling_total = Counter(
+    "pretix_vacc_autosched_scheduling_total",
+    "Positions the scheduling of a second dose finished for.",
+    ["event", "outcome"],
+)
+vacc_autosched_slot_search_iterations = Histogram(
+    "pretix_vacc_autosched_slot_search_iterations",
+    "Time slots tried before the scheduling of a second dose finished.",
+    ["event", "outcome"],
+    buckets=[0, 1, 2, 5, 10, 25, 50, 100, 250],
+)
+vacc_autosched_queries = Histogram(
+    "pretix_vacc_autosched_queries",
+    "Database queries run by a profiled task or view.",
+    ["operation"],
+    buckets=[5, 10, 25, 50, 100, 250, 500, 1000],
+)
+vacc_autosched_db_duration_seconds = Histogram(
+    "pretix_vacc_autosched_db_duration_seconds",
+    "Time spent in database queries by a profiled task or view.",
+    ["operation"],
+)
+
+
+def event_label(event):
+    return f"{event.organizer.slug}/{event.slug}"
+
+
+@contextmanager
+def phase(event, name):
+    """
+    Records the time spent in the block as phase ``name`` of ``event``, and as a span of
+    the current trace.
+    """
+    with span(name):
+        if not settings.METRICS_ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            vacc_autosched_phase_duration_seconds.observe(
+                time.perf_counter() - start, event=event_label(event), phase=name
+            )
+
+
+def observe_scheduling(event, outcome, started, iterations=0):
+    """
+    Records that scheduling a position of ``event``, started at ``started`` according to
+    ``time.perf_counter()``, finished with ``outcome`` after trying ``iterations`` slots.
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    label = event_label(event)
+    vacc_autosched_scheduling_total.inc(1, event=label, outcome=outcome)
+    vacc_autosched_scheduling_duration_seconds.observe(
+        time.perf_counter() - started, event=label, outcome=outcome
+    )
+    vacc_autosched_slot_search_iterations.observe(
+        iterations, event=label, outcome=outcome
+    )
+
+
+def observe_profile(operation, queries, db_time):
+    """
+    Records the number of queries and the database time of a profiled ``operation``.
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    vacc_autosched_queries.observe(queries, operation=operation)
+    vacc_autosched_db_duration_seconds.observe(db_time, operation=operation)
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.4 on 2021-07-20 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_vacc_autosched", "0004_itemconfig_second_item"),
+        ("pretixbase", "0195_auto_20210622_1457"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlotAvailability",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("availability", models.PositiveIntegerField()),
+                ("available_number", models.PositiveIntegerField(null=True)),
+                ("size", models.PositiveIntegerField(null=True)),
+                ("computed", models.DateTimeField()),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_availability",
+                        to="pretixbase.event",
+                    ),
+                ),
+                (
+                    "item",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_availability",
+                        to="pretixbase.item",
+                    ),
+                ),
+                (
+                    "subevent",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_availability",
+                        to="pretixbase.subevent",
+                    ),
+                ),
+                (
+                    "variation",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_availability",
+                        to="pretixbase.itemvariation",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("item", "variation", "subevent"),
+                        name="vacc_autosched_slotavailability_uniq_var",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("variation__isnull", True)),
+                        fields=("item", "subevent"),
+                        name="vacc_autosched_slotavailability_uniq_item",
+                    ),
+                ],
+            },
+        ),
+    ]
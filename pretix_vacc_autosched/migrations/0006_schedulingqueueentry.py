@@ -0,0 +1,43 @@
+# Generated by Django 3.2.4 on 2021-07-22 14:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0195_auto_20210622_1457"),
+        ("pretix_vacc_autosched", "0005_slotavailability"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SchedulingQueueEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_queue",
+                        to="pretixbase.event",
+                    ),
+                ),
+                (
+                    "position",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_queue_entry",
+                        to="pretixbase.orderposition",
+                    ),
+                ),
+            ],
+        ),
+    ]
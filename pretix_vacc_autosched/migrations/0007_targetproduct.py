@@ -0,0 +1,75 @@
+# Generated by Django 3.2.4 on 2021-07-26 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0195_auto_20210622_1457"),
+        ("pretix_vacc_autosched", "0006_schedulingqueueentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TargetProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("failure", models.CharField(blank=True, max_length=20)),
+                (
+                    "config",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="target_products",
+                        to="pretix_vacc_autosched.itemconfig",
+                    ),
+                ),
+                (
+                    "target_item",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.item",
+                    ),
+                ),
+                (
+                    "target_variation",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.itemvariation",
+                    ),
+                ),
+                (
+                    "variation",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.itemvariation",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("config", "variation"),
+                        name="vacc_autosched_targetproduct_uniq_var",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("variation__isnull", True)),
+                        fields=("config",),
+                        name="vacc_autosched_targetproduct_uniq_item",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.4 on 2021-07-29 08:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0195_auto_20210622_1457"),
+        ("pretix_vacc_autosched", "0007_targetproduct"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CapacityToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                (
+                    "link",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="capacity_tokens",
+                        to="pretix_vacc_autosched.linkedorderposition",
+                    ),
+                ),
+                (
+                    "quota",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_tokens",
+                        to="pretixbase.quota",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["quota", "link"], name="pretix_vacc_quota_i_056fe3_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.4 on 2021-07-30 09:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0195_auto_20210622_1457"),
+        ("pretix_vacc_autosched", "0008_capacitytoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("channel", models.CharField(max_length=10)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_outbox",
+                        to="pretixbase.event",
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_outbox",
+                        to="pretixbase.order",
+                    ),
+                ),
+                (
+                    "subevent",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_outbox",
+                        to="pretixbase.subevent",
+                    ),
+                ),
+            ],
+        ),
+    ]
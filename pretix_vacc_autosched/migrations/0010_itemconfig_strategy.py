@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2021-08-02 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_vacc_autosched", "0009_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="itemconfig",
+            name="strategy",
+            field=models.CharField(default="earliest", max_length=20),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.4 on 2021-08-04 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0195_auto_20210622_1457"),
+        ("pretix_vacc_autosched", "0010_itemconfig_strategy"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CodeLookup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("code", models.CharField(max_length=255)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_codes",
+                        to="pretixbase.event",
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_codes",
+                        to="pretixbase.order",
+                    ),
+                ),
+                (
+                    "position",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="vacc_autosched_codes",
+                        to="pretixbase.orderposition",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["event", "code"], name="pretix_vacc_event_i_7a0037_idx"
+                    )
+                ],
+            },
+        ),
+    ]
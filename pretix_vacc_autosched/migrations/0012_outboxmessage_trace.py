@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2021-08-20 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_vacc_autosched", "0011_codelookup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="trace",
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -1,9 +1,20 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from pretix.base.models import OrderPosition
+from pretix.base.models import OrderPosition, Quota
 
 
 class ItemConfig(models.Model):
+    STRATEGY_EARLIEST = "earliest"
+    STRATEGY_TIME = "time"
+    STRATEGY_LEAST_FILLED = "least_filled"
+    STRATEGY_RANDOM = "random"
+    STRATEGY_CHOICES = (
+        (STRATEGY_EARLIEST, _("Earliest available time slot")),
+        (STRATEGY_TIME, _("Time slot closest to the time of day of the first dose")),
+        (STRATEGY_LEAST_FILLED, _("Time slot with the smallest share of seats taken")),
+        (STRATEGY_RANDOM, _("Random time slot")),
+    )
+
     item = models.OneToOneField(
         "pretixbase.Item",
         related_name="vacc_autosched_config",
@@ -37,6 +48,17 @@ class ItemConfig(models.Model):
             "If empty, a product with the same name as the current one will be chosen"
         ),
     )
+    strategy = models.CharField(
+        max_length=20,
+        choices=STRATEGY_CHOICES,
+        default=STRATEGY_EARLIEST,
+        verbose_name=_("Scheduling of second dose: Time slot selection"),
+        help_text=_(
+            "Except for the earliest time slot, all options choose among the time slots between the number "
+            "of days and the maximum number of days. Later time slots are only used if none of them is "
+            "available."
+        ),
+    )
 
 
 class LinkedOrderPosition(models.Model):
@@ -46,3 +68,217 @@ class LinkedOrderPosition(models.Model):
     child_position = models.OneToOneField(
         OrderPosition, related_name="vacc_autosched_link", on_delete=models.PROTECT
     )
+
+
+class SlotAvailability(models.Model):
+    """
+    Materialized availability of a product in one time slot of the target event series.
+    Rows are created lazily when a slot is first looked at and refreshed whenever orders,
+    quotas or subevents of the slot change.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        related_name="vacc_autosched_availability",
+        on_delete=models.CASCADE,
+    )
+    item = models.ForeignKey(
+        "pretixbase.Item",
+        related_name="vacc_autosched_availability",
+        on_delete=models.CASCADE,
+    )
+    variation = models.ForeignKey(
+        "pretixbase.ItemVariation",
+        related_name="vacc_autosched_availability",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    subevent = models.ForeignKey(
+        "pretixbase.SubEvent",
+        related_name="vacc_autosched_availability",
+        on_delete=models.CASCADE,
+    )
+    availability = models.PositiveIntegerField()
+    available_number = models.PositiveIntegerField(null=True)
+    # Size of the quota that limits the availability, None if unlimited
+    size = models.PositiveIntegerField(null=True)
+    computed = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["item", "variation", "subevent"],
+                name="vacc_autosched_slotavailability_uniq_var",
+            ),
+            models.UniqueConstraint(
+                fields=["item", "subevent"],
+                condition=models.Q(variation__isnull=True),
+                name="vacc_autosched_slotavailability_uniq_item",
+            ),
+        ]
+
+    @property
+    def fill_level(self):
+        """
+        Share of the seats of the slot that are taken, from 0 to 1.
+        """
+        if self.availability != Quota.AVAILABILITY_OK:
+            return 1.0
+        if not self.size or self.available_number is None:
+            return 0.0
+        return max(self.size - self.available_number, 0) / self.size
+
+
+class SchedulingQueueEntry(models.Model):
+    """
+    A check-in waiting to be scheduled in the next batch, if check-ins are coalesced.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        related_name="vacc_autosched_queue",
+        on_delete=models.CASCADE,
+    )
+    position = models.OneToOneField(
+        OrderPosition,
+        related_name="vacc_autosched_queue_entry",
+        on_delete=models.CASCADE,
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class TargetProduct(models.Model):
+    """
+    Resolved second-dose product for one product or variation configured in ``ItemConfig``.
+    If no unique product could be found, ``target_item`` is empty and ``failure`` tells why.
+    """
+
+    FAILURE_EVENT = "event"
+    FAILURE_ITEM = "item"
+    FAILURE_VARIATION = "variation"
+
+    config = models.ForeignKey(
+        ItemConfig,
+        related_name="target_products",
+        on_delete=models.CASCADE,
+    )
+    variation = models.ForeignKey(
+        "pretixbase.ItemVariation",
+        related_name="+",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    target_item = models.ForeignKey(
+        "pretixbase.Item",
+        related_name="+",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    target_variation = models.ForeignKey(
+        "pretixbase.ItemVariation",
+        related_name="+",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    failure = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["config", "variation"],
+                name="vacc_autosched_targetproduct_uniq_var",
+            ),
+            models.UniqueConstraint(
+                fields=["config"],
+                condition=models.Q(variation__isnull=True),
+                name="vacc_autosched_targetproduct_uniq_item",
+            ),
+        ]
+
+
+class CapacityToken(models.Model):
+    """
+    One seat of a second-dose quota, used if bookings claim seats from a pre-materialized
+    pool instead of checking the quotas under a lock. A booking claims one token of every
+    quota with a size it counts against, by linking them to its ``LinkedOrderPosition``.
+    """
+
+    quota = models.ForeignKey(
+        "pretixbase.Quota",
+        related_name="vacc_autosched_tokens",
+        on_delete=models.CASCADE,
+    )
+    link = models.ForeignKey(
+        LinkedOrderPosition,
+        related_name="capacity_tokens",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["quota", "link"]),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification about a booked second dose that has not been delivered yet. Messages
+    are written in the same transaction as the booking and delivered by a background task,
+    so notifications are neither lost nor sent for bookings that were rolled back.
+    """
+
+    CHANNEL_EMAIL = "email"
+    CHANNEL_SMS = "sms"
+
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        related_name="vacc_autosched_outbox",
+        on_delete=models.CASCADE,
+    )
+    order = models.ForeignKey(
+        "pretixbase.Order",
+        related_name="vacc_autosched_outbox",
+        on_delete=models.CASCADE,
+    )
+    subevent = models.ForeignKey(
+        "pretixbase.SubEvent",
+        related_name="vacc_autosched_outbox",
+        on_delete=models.CASCADE,
+    )
+    channel = models.CharField(max_length=10)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # Context of the trace the booking was made in, see tracing.propagate()
+    trace = models.JSONField(null=True)
+
+
+class CodeLookup(models.Model):
+    """
+    Maps the case-normalized order code, order secret and position secrets of an order to
+    the order, so the self-service form can resolve any of them with one indexed query.
+    ``position`` is set for rows of position secrets.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        related_name="vacc_autosched_codes",
+        on_delete=models.CASCADE,
+    )
+    code = models.CharField(max_length=255)
+    order = models.ForeignKey(
+        "pretixbase.Order",
+        related_name="vacc_autosched_codes",
+        on_delete=models.CASCADE,
+    )
+    position = models.ForeignKey(
+        OrderPosition,
+        related_name="vacc_autosched_codes",
+        on_delete=models.CASCADE,
+        null=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["event", "code"]),
+        ]
@@ -0,0 +1,135 @@
+import logging
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from pretix_vacc_autosched.models import ItemConfig, TargetProduct
+
+logger = logging.getLogger(__name__)
+
+
+def get_configured_items(event):
+    """
+    Returns a dictionary mapping the IDs of all products of ``event`` with a second dose
+    configuration to the ID of the event series their second dose is booked in. The result
+    is cached until a configuration of the event is saved or deleted.
+    """
+    items = event.cache.get("vacc_autosched_configured_items")
+    if items is None:
+        items = {
+            item_id: target_event_id or event.pk
+            for item_id, target_event_id in ItemConfig.objects.filter(
+                item__event=event, days__isnull=False
+            ).values_list("item_id", "event_id")
+        }
+        event.cache.set("vacc_autosched_configured_items", items)
+    return items
+
+
+def clear_configured_items(event):
+    event.cache.delete("vacc_autosched_configured_items")
+
+
+def get_mapped_event_ids():
+    """
+    Returns the set of IDs of all events whose products are the source or a possible
+    target of a second dose configuration, i.e. the events in which changes to products
+    can change the resolved second-dose products. The result is cached until any
+    configuration is saved or deleted.
+    """
+    events = cache.get("vacc_autosched:mapped_events")
+    if events is None:
+        events = set()
+        for row in ItemConfig.objects.values_list(
+            "item__event_id", "event_id", "second_item__event_id"
+        ):
+            events.update(pk for pk in row if pk)
+        cache.set("vacc_autosched:mapped_events", events)
+    return events
+
+
+def clear_mapped_event_ids():
+    cache.delete("vacc_autosched:mapped_events")
+
+
+def product_name(item):
+    return item.internal_name or str(item.name)
+
+
+def find_items_by_name(event, item):
+    return [n for n in event.items.all() if product_name(n) == product_name(item)]
+
+
+def resolve_target_product(item, variation, event, prefer_second_item):
+    """
+    Finds the product and variation in ``event`` that is booked as the second dose of
+    ``item`` and ``variation``. Returns a tuple of the target product, the target variation
+    and a failure code from ``TargetProduct`` if no unique match exists.
+    """
+    logger.info(
+        f"SECOND DOSE: Looking up item for event {event.slug}, prefer item {prefer_second_item}"
+    )
+    if prefer_second_item:
+        target_item = prefer_second_item
+        if event != target_item.event:
+            logger.info(
+                f"SECOND DOSE: Abort because preferred item is for event {target_item.event.slug}"
+            )
+            return None, None, TargetProduct.FAILURE_EVENT
+    elif item.event_id == event.pk:
+        logger.info("SECOND DOSE: Choose same item because of same event")
+        return item, variation, ""
+    else:
+        possible_items = find_items_by_name(event, item)
+        if len(possible_items) != 1:
+            logger.info(
+                f"SECOND DOSE: Possible items by name: {repr([n.pk for n in possible_items])}"
+            )
+            return None, None, TargetProduct.FAILURE_ITEM
+
+        target_item = possible_items[0]
+
+    if variation or target_item.variations.exists():
+        possible_variations = [
+            n
+            for n in target_item.variations.all()
+            if str(n.value) == (str(variation.value) if variation else None)
+        ]
+        if len(possible_variations) != 1:
+            logger.info(
+                f"SECOND DOSE: Possible variations by name: {repr([n.pk for n in possible_variations])}"
+            )
+            return None, None, TargetProduct.FAILURE_VARIATION
+        target_var = possible_variations[0]
+    else:
+        target_var = None
+    return target_item, target_var, ""
+
+
+def refresh_target_products(config):
+    """
+    Resolves the second-dose product for the product of ``config`` and each of its
+    variations and stores the result. Returns a dictionary mapping source variation IDs
+    (``None`` for the product itself) to ``TargetProduct`` rows.
+    """
+    target_event = config.event or config.item.event
+    rows = {}
+    for variation in [None] + list(config.item.variations.all()):
+        target_item, target_variation, failure = resolve_target_product(
+            config.item, variation, target_event, config.second_item
+        )
+        rows[variation.pk if variation else None] = TargetProduct(
+            config=config,
+            variation=variation,
+            target_item=target_item,
+            target_variation=target_variation,
+            failure=failure,
+        )
+
+    try:
+        with transaction.atomic():
+            config.target_products.all().delete()
+            TargetProduct.objects.bulk_create(rows.values())
+    except IntegrityError:
+        # A concurrent refresh stored the same mapping
+        logger.info("SECOND DOSE: concurrent product mapping refresh, skipping")
+    return rows
@@ -0,0 +1,148 @@
+import functools
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connection
+
+from pretix_vacc_autosched.metrics import observe_profile
+
+logger = logging.getLogger(__name__)
+
+# Number of repeated statements included in the warning about a slow invocation
+TOP_STATEMENTS = 5
+
+_active = ContextVar("vacc_autosched_profile", default=False)
+
+
+def get_sample_rate():
+    return settings.CONFIG_FILE.getfloat(
+        "vacc_autosched", "profile_sample_rate", fallback=0.0
+    )
+
+
+class QueryProfile:
+    """
+    Counts the queries run on the default database connection and the time spent in
+    them, per SQL statement. Statements are recorded with their placeholders, so the
+    same query with different parameters is counted as one statement.
+    """
+
+    def __init__(self):
+        self.count = Counter()
+        self.duration = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count[sql] += 1
+            self.duration[sql] += time.perf_counter() - start
+
+    @property
+    def queries(self):
+        return sum(self.count.values())
+
+    @property
+    def db_time(self):
+        return sum(self.duration.values())
+
+    def repeated(self, n=TOP_STATEMENTS):
+        return [
+            (sql, c, self.duration[sql])
+            for sql, c in self.count.most_common(n)
+            if c > 1
+        ]
+
+
+@contextmanager
+def profile(name):
+    """
+    Records the number of queries and the database time of the block as operation
+    ``name`` for a sample of the invocations, as configured with ``profile_sample_rate``
+    in the ``[vacc_autosched]`` section of ``pretix.cfg``. A warning listing the most
+    repeated statements is logged if ``profile_max_queries`` or ``profile_max_db_time``
+    (in seconds) is exceeded. Blocks nested in a profiled block are not sampled again.
+    """
+    rate = get_sample_rate()
+    if _active.get() or rate <= 0 or random.random() >= rate:
+        yield
+        return
+
+    recorder = QueryProfile()
+    token = _active.set(True)
+    try:
+        with connection.execute_wrapper(recorder):
+            yield
+    finally:
+        _active.reset(token)
+        report(name, recorder)
+
+
+def report(name, recorder):
+    queries, db_time = recorder.queries, recorder.db_time
+    observe_profile(name, queries, db_time)
+
+    max_queries = settings.CONFIG_FILE.getint(
+        "vacc_autosched", "profile_max_queries", fallback=100
+    )
+    max_db_time = settings.CONFIG_FILE.getfloat(
+        "vacc_autosched", "profile_max_db_time", fallback=1.0
+    )
+    if queries <= max_queries and db_time <= max_db_time:
+        return
+
+    repeated = recorder.repeated()
+    logger.warning(
+        "SECOND DOSE: %s ran %d queries in %.0f ms%s",
+        name,
+        queries,
+        db_time * 1000,
+        "".join(
+            f"\n  {c}x {duration * 1000:.0f} ms: {sql}" for sql, c, duration in repeated
+        ),
+        extra={
+            "vacc_autosched_profile": {
+                "operation": name,
+                "queries": queries,
+                "db_time": db_time,
+                "max_queries": max_queries,
+                "max_db_time": max_db_time,
+                "repeated": [
+                    {"sql": sql, "count": c, "db_time": duration}
+                    for sql, c, duration in repeated
+                ],
+            }
+        },
+    )
+
+
+def profiled(func):
+    """
+    Profiles every call of the decorated task as an operation named after it.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def profiled_view(view):
+    """
+    Profiles every request to the decorated view, named after its URL pattern.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        match = request.resolver_match
+        with profile(match.url_name if match else view.__name__):
+            return view(request, *args, **kwargs)
+
+    return wrapper
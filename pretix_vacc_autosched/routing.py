@@ -0,0 +1,39 @@
+import hashlib
+from django.conf import settings
+
+
+def get_shard_count():
+    return settings.CONFIG_FILE.getint("vacc_autosched", "shards", fallback=0)
+
+
+def get_scheduling_queue(target_event_id):
+    """
+    Returns the name of the Celery queue that scheduling work for the target event series
+    ``target_event_id`` is sent to, or ``None`` if sharding is not configured. Each shard
+    queue is meant to be consumed by a single worker process, so all bookings into one
+    series run one after another instead of competing for its locks, while different
+    series are spread over the shards.
+
+    Events are assigned to shards by rendezvous hashing, so changing the number of shards
+    only moves the events of the shards that were added or removed.
+    """
+    shards = get_shard_count()
+    if shards < 1:
+        return None
+    prefix = settings.CONFIG_FILE.get(
+        "vacc_autosched", "queue_prefix", fallback="vacc_autosched"
+    )
+    shard = max(
+        range(shards),
+        key=lambda s: hashlib.sha1(f"{target_event_id}:{s}".encode()).digest(),
+    )
+    return f"{prefix}_{shard}"
+
+
+def scheduling_options(target_event_id):
+    """
+    Returns the keyword arguments for ``apply_async`` to route a scheduling task for the
+    target event series ``target_event_id``.
+    """
+    queue = get_scheduling_queue(target_event_id)
+    return {"queue": queue} if queue else {}
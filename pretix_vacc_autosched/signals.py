@@ -1,10 +1,27 @@
 import copy
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Min, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.urls import resolve, reverse
 from django.utils.safestring import mark_safe
+from django.utils.timezone import now
 from django.utils.translation import gettext_noop, gettext_lazy as _
+from django_scopes import scopes_disabled
 from i18nfield.rest_framework import I18nField
 from i18nfield.strings import LazyI18nString
+from pretix.base.models import (
+    Event,
+    Event_SettingsStore,
+    Item,
+    ItemVariation,
+    LogEntry,
+    Quota,
+    SubEvent,
+)
 from pretix.base.settings import settings_hierarkey
 from pretix.base.signals import (
     api_event_settings_fields,
@@ -12,14 +29,44 @@ from pretix.base.signals import (
     event_copy_data,
     item_copy_data,
     logentry_display,
+    order_approved,
+    order_canceled,
+    order_changed,
+    order_denied,
+    order_expired,
+    order_paid,
+    order_placed,
+    order_reactivated,
+    order_split,
+    periodic_task,
 )
 from pretix.control.signals import item_forms, nav_event_settings
 from rest_framework import serializers
 
-from pretix_vacc_autosched.tasks import schedule_second_dose
+from pretix_vacc_autosched.tasks import (
+    OUTBOX_MAX_ATTEMPTS,
+    QUEUE_OWNER,
+    claim_in_flight,
+    deliver_notifications,
+    enqueue_second_dose,
+    flush_scheduling_queue,
+    reconcile_capacity_pool,
+    refresh_slot_availability_index,
+    schedule_second_dose,
+)
 
+from .codes import update_code_lookup
 from .forms import ItemConfigForm
-from .models import ItemConfig
+from .models import ItemConfig, OutboxMessage, SchedulingQueueEntry, SlotAvailability
+from .products import (
+    clear_configured_items,
+    clear_mapped_event_ids,
+    get_configured_items,
+    get_mapped_event_ids,
+    refresh_target_products,
+)
+from .routing import scheduling_options
+from .tracing import propagate, start_trace
 
 
 @receiver(nav_event_settings, dispatch_uid="vacc_autosched_nav")
@@ -81,24 +128,209 @@ def event_copy_data_receiver(sender, other, question_map, item_map, **kwargs):
 
 @receiver(signal=checkin_created, dispatch_uid="vacc_autosched_checkin_created")
 def checkin_created_receiver(sender, checkin, **kwargs):
+    target_event_id = get_configured_items(sender).get(checkin.position.item_id)
+    if target_event_id is None:
+        return  # ignore, not configured
     if checkin.list.name.startswith("Print"):
         return  # ignore, not a "real" check-in
     if not sender.settings.vacc_autosched_checkin:
         return  # ignore, handled manually
 
+    if sender.settings.vacc_autosched_batch:
+        if claim_in_flight(checkin.position.pk, QUEUE_OWNER):
+            enqueue_second_dose(sender, checkin.position)
+        return
+
+    task_id = str(uuid.uuid4())
+    if not claim_in_flight(checkin.position.pk, task_id):
+        return  # already being scheduled, e.g. after a check-in on another list
+
+    with start_trace("checkin", event=sender.slug, position=checkin.position.pk):
+        schedule_second_dose.apply_async(
+            args=(
+                sender.pk,
+                checkin.position.pk,
+            ),
+            kwargs={"trace": propagate()},
+            task_id=task_id,
+            **scheduling_options(target_event_id),
+        )
+
+
+@receiver(order_placed, dispatch_uid="vacc_autosched_codes_placed")
+@receiver(order_changed, dispatch_uid="vacc_autosched_codes_changed")
+def order_codes_receiver(sender, order, **kwargs):
+    transaction.on_commit(lambda: update_code_lookup([order]))
+
+
+@receiver(order_split, dispatch_uid="vacc_autosched_codes_split")
+def order_split_codes_receiver(sender, original, split_order, **kwargs):
+    transaction.on_commit(lambda: update_code_lookup([original, split_order]))
+
+
+@receiver(post_save, sender=LogEntry, dispatch_uid="vacc_autosched_codes_secret")
+def order_secret_codes_receiver(sender, instance, created, **kwargs):
+    # Secrets are regenerated without any signal, but always with this log entry
+    if created and instance.action_type == "pretix.event.order.secret.changed":
+        order = instance.content_object
+        if "pretix_vacc_autosched" in order.event.get_plugins():
+            transaction.on_commit(lambda: update_code_lookup([order]))
+
+
+@receiver(post_save, sender=ItemConfig, dispatch_uid="vacc_autosched_config_saved")
+def itemconfig_saved_receiver(sender, instance, **kwargs):
+    refresh_target_products(instance)
+    itemconfig_changed_receiver(sender, instance)
+
+
+@receiver(post_delete, sender=ItemConfig, dispatch_uid="vacc_autosched_config_deleted")
+def itemconfig_changed_receiver(sender, instance, **kwargs):
+    transaction.on_commit(clear_mapped_event_ids)
     try:
-        ItemConfig.objects.get(item=checkin.position.item)
-    except ItemConfig.DoesNotExist:
-        return  # ignore, not configured
+        event = instance.item.event
+    except Item.DoesNotExist:
+        return  # deleted along with the whole event
+    transaction.on_commit(lambda: clear_configured_items(event))
 
-    schedule_second_dose.apply_async(
-        args=(
-            sender.pk,
-            checkin.position.pk,
+
+@receiver(post_save, sender=Item, dispatch_uid="vacc_autosched_item_saved")
+@receiver(post_delete, sender=Item, dispatch_uid="vacc_autosched_item_deleted")
+@receiver(
+    post_save, sender=ItemVariation, dispatch_uid="vacc_autosched_variation_saved"
+)
+@receiver(
+    post_delete, sender=ItemVariation, dispatch_uid="vacc_autosched_variation_deleted"
+)
+def product_changed_receiver(sender, instance, **kwargs):
+    # Mappings that pointed to a deleted product are removed by the cascade on
+    # TargetProduct, but others may become unambiguous and are resolved again as well.
+    try:
+        item = instance if isinstance(instance, Item) else instance.item
+    except Item.DoesNotExist:
+        return  # deleted along with its product
+    if item.event_id not in get_mapped_event_ids():
+        return  # not involved in any second dose configuration
+    config_ids = list(
+        ItemConfig.objects.filter(
+            Q(item=item)
+            | Q(second_item=item)
+            | Q(event_id=item.event_id)
+            | Q(event__isnull=True, item__event_id=item.event_id)
+        ).values_list("pk", flat=True)
+    )
+    if config_ids:
+        transaction.on_commit(
+            lambda: [
+                refresh_target_products(config)
+                for config in ItemConfig.objects.filter(pk__in=config_ids)
+            ]
+        )
+
+
+@receiver(signal=periodic_task, dispatch_uid="vacc_autosched_flush_queues")
+@scopes_disabled()
+def flush_scheduling_queues(sender, **kwargs):
+    # Safety net in case the delayed flush of a batch got lost, e.g. in a worker restart
+    oldest = dict(
+        SchedulingQueueEntry.objects.values("event_id")
+        .annotate(oldest=Min("created"))
+        .values_list("event_id", "oldest")
+    )
+    for event in Event.objects.filter(pk__in=oldest.keys()):
+        interval = timedelta(seconds=event.settings.vacc_autosched_batch_interval)
+        if oldest[event.pk] < now() - interval:
+            flush_scheduling_queue.apply_async(args=(event.pk,))
+
+
+@receiver(signal=periodic_task, dispatch_uid="vacc_autosched_redeliver_outbox")
+@scopes_disabled()
+def redeliver_outbox(sender, **kwargs):
+    # Safety net for notifications whose delivery task got lost or ran out of retries
+    messages = defaultdict(list)
+    for event_id, pk in OutboxMessage.objects.filter(
+        created__lt=now() - timedelta(minutes=10),
+        attempts__lt=OUTBOX_MAX_ATTEMPTS,
+    ).values_list("event_id", "pk"):
+        messages[event_id].append(pk)
+    for event_id, pks in messages.items():
+        deliver_notifications.apply_async(args=(event_id, pks))
+
+
+@receiver(signal=periodic_task, dispatch_uid="vacc_autosched_reconcile_pool")
+@scopes_disabled()
+def reconcile_capacity_pools(sender, **kwargs):
+    for event_id in Event_SettingsStore.objects.filter(
+        key="vacc_autosched_token_pool", value="True"
+    ).values_list("object_id", flat=True):
+        reconcile_capacity_pool.apply_async(args=(event_id,))
+
+
+def refresh_availability_on_commit(event_id, subevent_ids):
+    subevent_ids = [pk for pk in subevent_ids if pk]
+    if not subevent_ids:
+        return
+    if not SlotAvailability.objects.filter(subevent_id__in=subevent_ids).exists():
+        return  # nothing indexed yet, will be computed on first read
+    transaction.on_commit(
+        lambda: refresh_slot_availability_index.apply_async(
+            args=(event_id, subevent_ids)
         )
     )
 
 
+@receiver(
+    [
+        order_placed,
+        order_paid,
+        order_canceled,
+        order_reactivated,
+        order_expired,
+        order_changed,
+        order_approved,
+        order_denied,
+    ],
+    dispatch_uid="vacc_autosched_order_availability",
+)
+def order_availability_receiver(sender, order, signal, **kwargs):
+    positions = list(
+        order.all_positions.values_list("subevent_id", "vacc_autosched_link")
+    )
+    if signal in (order_placed, order_paid) and any(link for s, link in positions):
+        return  # booked by this plugin, which stores the new availability itself
+    refresh_availability_on_commit(sender.pk, {s for s, link in positions})
+
+
+@receiver(post_save, sender=Quota, dispatch_uid="vacc_autosched_quota_saved")
+@receiver(post_delete, sender=Quota, dispatch_uid="vacc_autosched_quota_deleted")
+def quota_availability_receiver(sender, instance, **kwargs):
+    refresh_availability_on_commit(instance.event_id, [instance.subevent_id])
+
+
+@receiver(
+    m2m_changed, sender=Quota.items.through, dispatch_uid="vacc_autosched_quota_items"
+)
+@receiver(
+    m2m_changed,
+    sender=Quota.variations.through,
+    dispatch_uid="vacc_autosched_quota_variations",
+)
+def quota_products_receiver(sender, instance, action, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if isinstance(instance, Quota):
+        refresh_availability_on_commit(instance.event_id, [instance.subevent_id])
+    elif pk_set:
+        for event_id, subevent_id in Quota.objects.filter(pk__in=pk_set).values_list(
+            "event_id", "subevent_id"
+        ):
+            refresh_availability_on_commit(event_id, [subevent_id])
+
+
+@receiver(post_save, sender=SubEvent, dispatch_uid="vacc_autosched_subevent_saved")
+def subevent_availability_receiver(sender, instance, **kwargs):
+    refresh_availability_on_commit(instance.event_id, [instance.pk])
+
+
 @receiver(
     signal=api_event_settings_fields,
     dispatch_uid="vacc_autosched_api_event_settings_fields",
@@ -106,6 +338,14 @@ def checkin_created_receiver(sender, checkin, **kwargs):
 def recv_api_event_settings_fields(sender, **kwargs):
     return {
         "vacc_autosched_checkin": serializers.BooleanField(required=False),
+        "vacc_autosched_batch": serializers.BooleanField(required=False),
+        "vacc_autosched_batch_interval": serializers.IntegerField(
+            required=False, min_value=1
+        ),
+        "vacc_autosched_batch_size": serializers.IntegerField(
+            required=False, min_value=1
+        ),
+        "vacc_autosched_token_pool": serializers.BooleanField(required=False),
         "vacc_autosched_mail": serializers.BooleanField(required=False),
         "vacc_autosched_subject": I18nField(required=False),
         "vacc_autosched_body": I18nField(required=False),
@@ -114,6 +354,13 @@ def recv_api_event_settings_fields(sender, **kwargs):
         "vacc_autosched_self_service": serializers.BooleanField(required=False),
         "vacc_autosched_self_service_info": I18nField(required=False),
         "vacc_autosched_self_service_order_info": I18nField(required=False),
+        "vacc_autosched_self_service_cache_ttl": serializers.IntegerField(
+            required=False, min_value=0
+        ),
+        "vacc_autosched_self_service_async": serializers.BooleanField(required=False),
+        "vacc_autosched_waiting_room_rate": serializers.IntegerField(
+            required=False, min_value=0
+        ),
     }
 
 
@@ -161,6 +408,9 @@ def badges_logentry_display(sender, logentry, **kwargs):
 
 settings_hierarkey.add_default("vacc_autosched_mail", False, bool)
 settings_hierarkey.add_default("vacc_autosched_self_service", False, bool)
+settings_hierarkey.add_default("vacc_autosched_self_service_cache_ttl", 5, int)
+settings_hierarkey.add_default("vacc_autosched_self_service_async", False, bool)
+settings_hierarkey.add_default("vacc_autosched_waiting_room_rate", 0, int)
 settings_hierarkey.add_default(
     "vacc_autosched_self_service_info",
     "",
@@ -202,3 +452,9 @@ settings_hierarkey.add_default(
     LazyI18nString,
 )
 settings_hierarkey.add_default("vacc_autosched_checkin", True, bool)
+settings_hierarkey.add_default("vacc_autosched_batch", False, bool)
+settings_hierarkey.add_default("vacc_autosched_batch_interval", 30, int)
+settings_hierarkey.add_default("vacc_autosched_batch_size", 50, int)
+settings_hierarkey.add_default("vacc_autosched_token_pool", False, bool)
+# Set by the vacc_autosched_build_code_lookup command once all existing orders are indexed
+settings_hierarkey.add_default("vacc_autosched_codes_backfilled", False, bool)
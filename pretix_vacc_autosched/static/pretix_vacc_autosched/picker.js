@@ -0,0 +1,70 @@
+/* Loads the time slots of a day on demand instead of reloading the booking page */
+document.addEventListener("DOMContentLoaded", function () {
+    var series = document.getElementById("date-series");
+    var days = document.getElementById("date-days");
+    if (!series || !days) {
+        return;
+    }
+    var container = document.getElementById("id_subevent");
+    var dateFormat = new Intl.DateTimeFormat(document.documentElement.lang || undefined, {dateStyle: "medium"});
+
+    function renderSlots(data) {
+        container.innerHTML = "";
+        if (!data.slots.length) {
+            var empty = document.createElement("p");
+            empty.className = "text-muted";
+            empty.textContent = series.getAttribute("data-empty");
+            container.appendChild(empty);
+            return;
+        }
+        data.slots.forEach(function (slot) {
+            var choice = document.createElement("div");
+            choice.className = "radio subevent-choice";
+
+            var input = document.createElement("input");
+            input.type = "radio";
+            input.name = "subevent";
+            input.value = slot.id;
+            input.id = "id_subevent_" + slot.id;
+            input.title = slot.date_from;
+
+            var label = document.createElement("label");
+            label.className = "subevent-info";
+            label.htmlFor = input.id;
+            var date = document.createElement("strong");
+            date.textContent = dateFormat.format(new Date(data.date + "T00:00:00"));
+            var time = document.createElement("span");
+            time.className = "time";
+            time.textContent = slot.time_to ? slot.time + " – " + slot.time_to : slot.time;
+            label.appendChild(date);
+            label.appendChild(time);
+
+            choice.appendChild(input);
+            choice.appendChild(label);
+            container.appendChild(choice);
+        });
+    }
+
+    days.addEventListener("click", function (e) {
+        var link = e.target.closest("a[data-date]");
+        if (!link) {
+            return;
+        }
+        e.preventDefault();
+        var url = series.getAttribute("data-url") + "?date=" + encodeURIComponent(link.getAttribute("data-date"));
+        fetch(url, {credentials: "same-origin"}).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        }).then(function (data) {
+            days.querySelectorAll("li").forEach(function (li) {
+                li.classList.remove("active");
+            });
+            link.parentNode.classList.add("active");
+            renderSlots(data);
+        }).catch(function () {
+            window.location.href = link.href;
+        });
+    });
+});
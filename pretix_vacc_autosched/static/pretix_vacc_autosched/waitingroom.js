@@ -0,0 +1,36 @@
+/* Polls the queue position in the waiting room and continues once the visitor is admitted */
+document.addEventListener("DOMContentLoaded", function () {
+    var room = document.getElementById("waiting-room");
+    if (!room) {
+        return;
+    }
+    var position = document.getElementById("waiting-room-position");
+    var wait = document.getElementById("waiting-room-wait");
+
+    function poll() {
+        fetch(room.getAttribute("data-url"), {credentials: "same-origin"}).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        }).then(function (data) {
+            if (data.admitted) {
+                window.location.reload();
+                return;
+            }
+            position.textContent = data.position;
+            wait.textContent = data.wait;
+            schedule(data.wait);
+        }).catch(function () {
+            schedule(30);
+        });
+    }
+
+    function schedule(seconds) {
+        // Spread out the polls of everyone who started waiting at the same time
+        var delay = Math.min(Math.max(seconds / 2, 2), 30);
+        window.setTimeout(poll, (delay + Math.random() * delay / 2) * 1000);
+    }
+
+    schedule(parseInt(wait.textContent, 10) || 2);
+});
@@ -1,80 +1,270 @@
 import logging
+import random
+import time
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime, timedelta
 from decimal import Decimal
-from django.db import transaction
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Q
 from django.utils.formats import date_format
 from django.utils.timezone import make_aware, now
 from django.utils.translation import gettext_lazy as _
 from pretix.base.email import get_email_context
 from pretix.base.i18n import language
-from pretix.base.models import Order, OrderPosition, Quota
+from pretix.base.models import (
+    LogEntry,
+    Order,
+    OrderPosition,
+    QuestionAnswer,
+    Quota,
+    Transaction,
+)
 from pretix.base.services.locking import LockTimeoutException, lock_objects
-from pretix.base.services.mail import SendMailException, TolerantDict
+from pretix.base.services.mail import TolerantDict
 from pretix.base.services.tasks import EventTask
 from pretix.base.signals import order_paid, order_placed
 from pretix.celery_app import app
 
+from pretix_vacc_autosched.availability import (
+    SlotCapacity,
+    claim_capacity_tokens,
+    get_pool_availability,
+    get_pooled_quotas,
+    get_slot_availability,
+    order_by_strategy,
+    reconcile_capacity_tokens,
+    refresh_slot_availability,
+    store_slot_availability,
+    uses_capacity_pool,
+)
+from pretix_vacc_autosched.codes import build_code_lookup
 from pretix_vacc_autosched.forms import can_use_juvare_api
-from pretix_vacc_autosched.models import LinkedOrderPosition
+from pretix_vacc_autosched.metrics import (
+    OUTCOME_ALREADY_SCHEDULED,
+    OUTCOME_LOCK_TIMEOUT,
+    OUTCOME_NO_PRODUCT,
+    OUTCOME_SCHEDULED,
+    OUTCOME_SOLD_OUT,
+    observe_scheduling,
+    phase,
+)
+from pretix_vacc_autosched.models import (
+    CapacityToken,
+    LinkedOrderPosition,
+    OutboxMessage,
+    SchedulingQueueEntry,
+    TargetProduct,
+)
+from pretix_vacc_autosched.products import (
+    refresh_target_products,
+    resolve_target_product,
+)
+from pretix_vacc_autosched.profiling import profiled
+from pretix_vacc_autosched.routing import scheduling_options
+from pretix_vacc_autosched.tracing import (
+    propagate,
+    resume,
+    span,
+    start_trace,
+    traced,
+    with_trace,
+)
 
 logger = logging.getLogger(__name__)
 
+MAX_SUBEVENTS_CHECKED = 250
+
+# Retries after lock timeouts wait about 15s, 30s, 60s, ... but never more than 10 minutes
+RETRY_BACKOFF_BASE = 15
+RETRY_BACKOFF_MAX = 600
+
+# Covers all retries of a scheduling task. If the check-in that queued a task is rolled
+# back, the position cannot be scheduled through another check-in for this long.
+IN_FLIGHT_TTL = 900
+
+# Owner of the in-flight registration of positions queued for a batch, until the batch
+# task scheduling them takes over
+QUEUE_OWNER = "queue"
+
+# Messages that failed this often are given up on by the periodic redelivery
+OUTBOX_MAX_ATTEMPTS = 10
+
 
 def get_for_other_event(op, event, prefer_second_item):
-    logger.info(f"SECOND DOSE: Looking up item for event {event.slug}, prefer item {prefer_second_item}")
-    if prefer_second_item:
-        target_item = prefer_second_item
-        if event != target_item.event:
-            logger.info(f"SECOND DOSE: Abort because preferred item is for event {target_item.event.slug}")
-            return None, None
-    elif op.order.event == event:
-        logger.info(f"SECOND DOSE: Choose same item because of same event")
+    if op.order.event == event and not prefer_second_item:
+        logger.info("SECOND DOSE: Choose same item because of same event")
         return op.item, op.variation
+
+    target = (
+        TargetProduct.objects.filter(
+            config__item_id=op.item_id, variation_id=op.variation_id
+        )
+        .select_related("config", "target_item", "target_variation")
+        .first()
+    )
+    if target is None:
+        config = getattr(op.item, "vacc_autosched_config", None)
+        if config:
+            target = refresh_target_products(config).get(op.variation_id)
+    if target is None or (
+        (target.config.event_id or op.item.event_id) != event.pk
+        or target.config.second_item_id != getattr(prefer_second_item, "pk", None)
+    ):
+        # Not resolved yet, or asked for a different target than configured
+        target_item, target_var, failure = resolve_target_product(
+            op.item, op.variation, event, prefer_second_item
+        )
     else:
-        possible_items = [
-            n
-            for n in event.items.all()
-            if (n.internal_name or str(n.name))
-            == (op.item.internal_name or str(op.item.name))
-        ]
-        if len(possible_items) != 1:
-            op.order.log_action(
-                "pretix_vacc_autosched.failed",
-                data={
+        target_item, target_var, failure = (
+            target.target_item,
+            target.target_variation,
+            target.failure,
+        )
+
+    if failure == TargetProduct.FAILURE_ITEM:
+        op.order.log_action(
+            "pretix_vacc_autosched.failed",
+            data=with_trace(
+                {
                     "reason": _("No product found"),
                     "position": op.pk,
-                },
-            )
-            logger.info(f"SECOND DOSE: Possible items by name: {repr([n.pk for n in possible_items])}")
-            return None, None
-
-        target_item = possible_items[0]
-
-    if op.variation or target_item.variations.exists():
-        possible_variations = [
-            n
-            for n in target_item.variations.all()
-            if str(n.value) == (str(op.variation.value) if op.variation else None)
-        ]
-        if len(possible_variations) != 1:
-            logger.info(f"SECOND DOSE: Possible variations by name: {repr([n.pk for n in possible_variations])}")
-            op.order.log_action(
-                "pretix_vacc_autosched.failed",
-                data={
+                }
+            ),
+        )
+    elif failure == TargetProduct.FAILURE_VARIATION:
+        op.order.log_action(
+            "pretix_vacc_autosched.failed",
+            data=with_trace(
+                {
                     "reason": _("No product variation found"),
                     "position": op.pk,
-                },
-            )
-            return None, None
-        target_var = possible_variations[0]
-    else:
-        target_var = None
+                }
+            ),
+        )
     return target_item, target_var
 
 
-@app.task(base=EventTask, bind=True, max_retries=5, default_retry_delay=60)
-def schedule_second_dose(self, event, op):
+def get_earliest_date(op, event, itemconf):
+    return make_aware(
+        datetime.combine(
+            op.subevent.date_from.astimezone(event.timezone).date()
+            + timedelta(days=itemconf.days),
+            op.subevent.date_from.astimezone(event.timezone).time(),
+        ),
+        event.timezone,
+    )
+
+
+def log_no_slot_found(op, earliest_date, candidates):
+    if len(candidates) < MAX_SUBEVENTS_CHECKED:
+        logger.info(f"SECOND DOSE: no time slot found after {earliest_date}")
+        op.order.log_action(
+            "pretix_vacc_autosched.failed",
+            data=with_trace(
+                {
+                    "reason": _("No available time slot found"),
+                    "position": op.pk,
+                }
+            ),
+        )
+        return
+
+    logger.info(
+        f"SECOND DOSE: no available time slot found after {MAX_SUBEVENTS_CHECKED} tries"
+    )
+    op.order.log_action(
+        "pretix_vacc_autosched.failed",
+        data=with_trace(
+            {
+                "reason": _("No available time slot found"),
+                "position": op.pk,
+                "last_looked_at": candidates[-1].pk,
+            }
+        ),
+    )
+
+
+def in_flight_key(position_id):
+    return f"vacc_autosched:inflight:{position_id}"
+
+
+def claim_in_flight(position_id, owner):
+    """
+    Registers scheduling of the position ``position_id`` as in flight, owned by ``owner``
+    (the ID of the task scheduling it, or a marker for the batch queue). Returns ``False``
+    if it already is in flight, in which case it should not be scheduled again.
+    """
+    return cache.add(in_flight_key(position_id), owner, IN_FLIGHT_TTL)
+
+
+def claim_batch_in_flight(position_ids, owner):
+    """
+    Registers scheduling of the positions ``position_ids`` as in flight, owned by the batch
+    task ``owner``, taking over positions that were queued for a batch. Returns the IDs of
+    the positions the task may schedule, i.e. all but the ones in flight in other tasks.
+    """
+    current = cache.get_many([in_flight_key(p) for p in position_ids])
+    claimed = []
+    for position_id in position_ids:
+        current_owner = current.get(in_flight_key(position_id))
+        if current_owner == QUEUE_OWNER:
+            cache.set(in_flight_key(position_id), owner, IN_FLIGHT_TTL)
+        elif current_owner != owner and not claim_in_flight(position_id, owner):
+            continue
+        claimed.append(position_id)
+    return claimed
+
+
+def release_in_flight(position_ids, owner):
+    """
+    Releases the in-flight registration of those of the positions ``position_ids`` that
+    are owned by ``owner``.
+    """
+    keys = [in_flight_key(p) for p in position_ids]
+    cache.delete_many([k for k, v in cache.get_many(keys).items() if v == owner])
+
+
+class SchedulingTask(EventTask):
+    """
+    Base of the scheduling tasks, which take a position ID or a list of position IDs as
+    their second argument. Releases the in-flight registration of the positions the task
+    owns once it has finished, but not while it is being retried.
+    """
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        positions = args[1] if isinstance(args[1], (list, tuple)) else [args[1]]
+        release_in_flight(positions, owner=task_id)
+
+
+def retry_countdown(retries):
+    """
+    Returns the delay before retry number ``retries`` of a task, growing exponentially
+    with jitter so that tasks that failed together do not retry together.
+    """
+    delay = min(RETRY_BACKOFF_BASE * 2**retries, RETRY_BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+@app.task(base=SchedulingTask, bind=True, max_retries=5)
+@traced
+@profiled
+def schedule_second_dose(self, event, op, target=None, checked=None):
+    """
+    Schedules the second dose for the position ``op`` of ``event``. If the task is retried
+    after a lock timeout, the resolved target product is passed on as ``target`` and the
+    slots that were already found to be sold out as ``checked``, so the retry continues
+    where this run stopped.
+    """
+    started = time.perf_counter()
+    # Check-ins register the task as in flight when queueing it, other callers here
+    owner = cache.get(in_flight_key(op))
+    if owner != self.request.id and not claim_in_flight(op, self.request.id):
+        logger.info(f"SECOND DOSE: Scheduling of position {op} already in flight")
+        return
+
+    checked = list(checked or [])
     op = OrderPosition.objects.select_related(
         "item", "variation", "subevent", "order"
     ).get(pk=op)
@@ -85,47 +275,48 @@ def schedule_second_dose(self, event, op):
         Q(base_position=op) | Q(child_position=op)
     ).exists():
         logger.info("SECOND DOSE: Scheduling aborted, seond dose already booked")
+        observe_scheduling(event, OUTCOME_ALREADY_SCHEDULED, started)
         return
 
     itemconf = op.item.vacc_autosched_config
-    earliest_date = make_aware(
-        datetime.combine(
-            op.subevent.date_from.astimezone(event.timezone).date()
-            + timedelta(days=itemconf.days),
-            op.subevent.date_from.astimezone(event.timezone).time(),
-        ),
-        event.timezone,
-    )
+    earliest_date = get_earliest_date(op, event, itemconf)
 
     target_event = itemconf.event or event
-    target_item, target_var = get_for_other_event(
-        op, target_event, itemconf.second_item
-    )
+    with phase(event, "resolve_product"):
+        if target:
+            target_item = target_event.items.get(pk=target[0])
+            target_var = target_item.variations.get(pk=target[1]) if target[1] else None
+        else:
+            target_item, target_var = get_for_other_event(
+                op, target_event, itemconf.second_item
+            )
 
-    logger.info(f"SECOND DOSE: date after {earliest_date}, target_event {target_event.slug}, target_item {target_item.pk if target_item else None}, target_variation {target_var.pk if target_var else None}")
+    logger.info(
+        f"SECOND DOSE: date after {earliest_date}, target_event {target_event.slug}, "
+        f"target_item {target_item.pk if target_item else None}, "
+        f"target_variation {target_var.pk if target_var else None}"
+    )
 
     if target_item is None:
+        observe_scheduling(event, OUTCOME_NO_PRODUCT, started)
         return
 
-    for i in range(250):  # max number of subevents to check
-        subevent = (
+    with phase(event, "slot_search"):
+        candidates = list(
             target_event.subevents.filter(
                 date_from__gte=earliest_date,
             )
-            .order_by("date_from")
-            .first()
+            .exclude(pk__in=checked)
+            .order_by("date_from")[:MAX_SUBEVENTS_CHECKED]
         )
-        if not subevent:
-            logger.info(f"SECOND DOSE: no time slot found after {earliest_date}")
-            op.order.log_action(
-                "pretix_vacc_autosched.failed",
-                data={
-                    "reason": _("No available time slot found"),
-                    "position": op.pk,
-                },
-            )
-            return
-
+        rows = get_slot_availability(candidates, target_item, target_var)
+        available = [
+            s for s in candidates if rows[s.pk].availability == Quota.AVAILABILITY_OK
+        ]
+        slots = order_by_strategy(
+            available, itemconf, earliest_date, lambda s: rows[s.pk].fill_level
+        )
+    for subevent in slots:
         try:
             order = book_second_dose(
                 op=op,
@@ -134,36 +325,290 @@ def schedule_second_dose(self, event, op):
                 subevent=subevent,
                 original_event=event,
             )
-            if not order:
-                earliest_date = subevent.date_from + timedelta(minutes=1)
-                continue
-            else:
-                return
         except LockTimeoutException:
-            self.retry()
+            observe_scheduling(event, OUTCOME_LOCK_TIMEOUT, started, len(checked) + 1)
+            self.retry(
+                args=(event.pk, op.pk),
+                kwargs={
+                    "target": (target_item.pk, target_var.pk if target_var else None),
+                    "checked": checked,
+                    "trace": propagate(),
+                },
+                countdown=retry_countdown(self.request.retries),
+            )
+        if order:
+            observe_scheduling(event, OUTCOME_SCHEDULED, started, len(checked) + 1)
+            return
+        checked.append(subevent.pk)
 
-    logger.info(f"SECOND DOSE: no available time slot found after 250 tries")
-    op.order.log_action(
-        "pretix_vacc_autosched.failed",
-        data={
-            "reason": _("No available time slot found"),
-            "position": op.pk,
-            "last_looked_at": subevent.pk,
-        },
+    observe_scheduling(event, OUTCOME_SOLD_OUT, started, len(checked))
+    log_no_slot_found(op, earliest_date, candidates)
+
+
+@app.task(base=SchedulingTask, bind=True, max_retries=5)
+@traced
+@profiled
+def schedule_second_doses(self, event, positions):
+    """
+    Batch variant of ``schedule_second_dose``. Schedules the second dose for all given
+    positions of ``event``, acquiring the locks for every target event series only once.
+    """
+    started = time.perf_counter()
+    claimed = claim_batch_in_flight(positions, self.request.id)
+    if len(claimed) < len(positions):
+        logger.info(
+            f"SECOND DOSE: Scheduling of {len(positions) - len(claimed)} positions already in flight"
+        )
+    ops = list(
+        OrderPosition.objects.filter(order__event=event, pk__in=claimed)
+        .select_related("item", "variation", "subevent", "order")
+        .order_by("pk")
     )
-    return
+    logger.info(f"SECOND DOSE: Batch scheduling started for {len(ops)} positions")
 
+    linked = set()
+    for base, child in LinkedOrderPosition.objects.filter(
+        Q(base_position__in=ops) | Q(child_position__in=ops)
+    ).values_list("base_position_id", "child_position_id"):
+        linked.update((base, child))
 
-def book_second_dose(*, op, item, variation, subevent, original_event):
-    event = item.event
-    with transaction.atomic():
-        lock_objects([event])
-        avcode, avnr = item.check_quotas(subevent=subevent, fail_on_no_quotas=True)
-        if avcode != Quota.AVAILABILITY_OK:
-            logger.info(f"SECOND DOSE: cannot use slot {subevent.pk}, sold out")
-            # sold out, look for next one
+    groups = defaultdict(list)
+    for op in ops:
+        if op.pk in linked:
+            logger.info(
+                f"SECOND DOSE: Scheduling aborted for {op.order.code}, seond dose already booked"
+            )
+            observe_scheduling(event, OUTCOME_ALREADY_SCHEDULED, started)
+            continue
+        itemconf = getattr(op.item, "vacc_autosched_config", None)
+        if not itemconf or not op.subevent:
+            logger.info(
+                f"SECOND DOSE: Scheduling aborted for {op.order.code}, not configured"
+            )
+            continue
+
+        target_event = itemconf.event or event
+        with phase(event, "resolve_product"):
+            target_item, target_var = get_for_other_event(
+                op, target_event, itemconf.second_item
+            )
+        if target_item is None:
+            observe_scheduling(event, OUTCOME_NO_PRODUCT, started)
+            continue
+        groups[target_event].append(
+            (op, target_item, target_var, get_earliest_date(op, event, itemconf))
+        )
+
+    groups = list(groups.items())
+    for i, (target_event, bookings) in enumerate(groups):
+        try:
+            booked = book_second_doses(
+                target_event=target_event, bookings=bookings, original_event=event
+            )
+        except LockTimeoutException:
+            for b in bookings:
+                observe_scheduling(event, OUTCOME_LOCK_TIMEOUT, started)
+            # Only retry the positions of the series that have not been booked yet. The
+            # others are released now, as the task does not finish before the retry.
+            retried = [b[0].pk for g in groups[i:] for b in g[1]]
+            release_in_flight(set(claimed) - set(retried), owner=self.request.id)
+            self.retry(
+                args=(event.pk, retried),
+                kwargs={"trace": propagate()},
+                countdown=retry_countdown(self.request.retries),
+            )
+        for op, item, variation, earliest_date in bookings:
+            observe_scheduling(
+                event,
+                OUTCOME_SCHEDULED if op.pk in booked else OUTCOME_SOLD_OUT,
+                started,
+            )
+
+
+def flush_key(event, delayed=False):
+    return f"vacc_autosched:flush:{'delayed' if delayed else 'now'}:{event.pk}"
+
+
+def enqueue_second_dose(event, position):
+    """
+    Queues ``position`` for the next batch of ``event``. A flush is triggered right away once
+    the batch is full, otherwise a flush is scheduled after the configured interval unless
+    one is already pending. Pending flushes are flagged in the cache, so concurrent
+    check-ins do not trigger another flush each.
+    """
+    SchedulingQueueEntry.objects.get_or_create(event=event, position=position)
+    pending = SchedulingQueueEntry.objects.filter(event=event).count()
+    interval = event.settings.vacc_autosched_batch_interval
+    if pending >= event.settings.vacc_autosched_batch_size:
+        if cache.add(flush_key(event), True, interval):
+            transaction.on_commit(
+                lambda: flush_scheduling_queue.apply_async(args=(event.pk,))
+            )
+    elif cache.add(flush_key(event, delayed=True), True, interval):
+        transaction.on_commit(
+            lambda: flush_scheduling_queue.apply_async(
+                args=(event.pk,), countdown=interval
+            )
+        )
+
+
+@app.task(base=EventTask)
+@profiled
+def flush_scheduling_queue(event):
+    """
+    Dispatches all queued check-ins of ``event`` in batches. Entries are only removed from
+    the queue once their batch has been handed to the broker, so they are retried by the
+    periodic flush if that fails.
+    """
+    cache.delete_many([flush_key(event), flush_key(event, delayed=True)])
+    batch_size = event.settings.vacc_autosched_batch_size
+    while True:
+        with transaction.atomic():
+            entries = list(
+                SchedulingQueueEntry.objects.select_for_update(of=("self",))
+                .filter(event=event)
+                .order_by("pk")
+                .values_list(
+                    "pk",
+                    "position_id",
+                    "position__item__vacc_autosched_config__event",
+                )[:batch_size]
+            )
+            if not entries:
+                return
+
+            logger.info(
+                f"SECOND DOSE: Flushing {len(entries)} queued check-ins for {event.slug}"
+            )
+            positions_by_target = defaultdict(list)
+            for pk, position_id, target_event_id in entries:
+                positions_by_target[target_event_id or event.pk].append(position_id)
+            for target_event_id, positions in positions_by_target.items():
+                with start_trace(
+                    "flush_scheduling_queue", event=event.slug, positions=len(positions)
+                ):
+                    schedule_second_doses.apply_async(
+                        args=(event.pk, positions),
+                        kwargs={"trace": propagate()},
+                        **scheduling_options(target_event_id),
+                    )
+            SchedulingQueueEntry.objects.filter(pk__in=[e[0] for e in entries]).delete()
+        if len(entries) < batch_size:
             return
 
+
+@app.task(base=EventTask)
+@profiled
+def refresh_slot_availability_index(event, subevents):
+    refresh_slot_availability(event, subevents)
+    reconcile_capacity_tokens(
+        Quota.objects.filter(
+            subevent_id__in=subevents, vacc_autosched_tokens__isnull=False
+        )
+        .distinct()
+        .select_related("event")
+    )
+
+
+@app.task(base=EventTask)
+@profiled
+def reconcile_capacity_pool(event):
+    """
+    Reconciles the capacity pools of the quotas of all upcoming slots configured as second
+    dose for products of ``event``, creating the pools of slots that have none yet.
+    """
+    targets = TargetProduct.objects.filter(
+        config__item__event=event, target_item__isnull=False
+    )
+    items = targets.filter(target_variation__isnull=True).values("target_item")
+    reconcile_capacity_tokens(
+        Quota.objects.filter(
+            Q(items__in=items) | Q(variations__in=targets.values("target_variation")),
+            subevent__date_from__gte=now(),
+        )
+        .distinct()
+        .select_related("event")
+    )
+
+
+@app.task(base=EventTask)
+@profiled
+def backfill_code_lookup(event):
+    build_code_lookup(event)
+
+
+def get_question_map(event):
+    """
+    Maps the identifiers of all questions of ``event`` to a tuple of the question and a
+    dictionary of its options by identifier.
+    """
+    return {
+        q.identifier: (q, {o.identifier: o for o in q.options.all()})
+        for q in event.questions.prefetch_related("options")
+    }
+
+
+def copy_answers(op, childpos, question_map):
+    """
+    Copies all answers of ``op`` to ``childpos``, matching questions and options by their
+    identifier. Answers and selected options are inserted in bulk.
+    """
+    childanswers = []
+    childoptions = []
+    for answ in (
+        QuestionAnswer.objects.filter(orderposition=op)
+        .select_related("question")
+        .prefetch_related("options")
+    ):
+        q, options = question_map.get(answ.question.identifier, (None, None))
+        if not q:
+            continue
+        childansw = QuestionAnswer(
+            orderposition=childpos, question=q, answer=answ.answer, file=answ.file
+        )
+        childanswers.append(childansw)
+        childoptions.append(
+            [
+                options[o.identifier]
+                for o in answ.options.all()
+                if o.identifier in options
+            ]
+        )
+
+    QuestionAnswer.objects.bulk_create(childanswers)
+    QuestionAnswer.options.through.objects.bulk_create(
+        [
+            QuestionAnswer.options.through(
+                questionanswer_id=childansw.pk, questionoption_id=option.pk
+            )
+            for childansw, options in zip(childanswers, childoptions)
+            for option in options
+        ]
+    )
+
+
+def create_child_order(
+    *,
+    op,
+    item,
+    variation,
+    subevent,
+    original_event,
+    logentries=None,
+    question_map=None,
+):
+    """
+    Creates the order and position for the second dose of ``op``, including copies of all
+    answers. Log entries are saved right away unless a list is passed as ``logentries``,
+    in which case they are appended to it for a later bulk insert. ``question_map`` can be
+    passed to reuse the result of ``get_question_map`` for many bookings in one event.
+    """
+    event = item.event
+    save_logs = logentries is None
+    if save_logs:
+        logentries = []
+
+    with phase(original_event, "create_order"):
         childorder = Order.objects.create(
             event=event,
             status=Order.STATUS_PAID,
@@ -181,25 +626,39 @@ def book_second_dose(*, op, item, variation, subevent, original_event):
             ),
             meta_info=op.order.meta_info,
         )
-        op.order.log_action(
-            "pretix_vacc_autosched.scheduled",
-            data={
-                "position": op.pk,
-                "event": event.pk,
-                "event_slug": event.slug,
-                "order": childorder.code,
-            },
+        logentries.append(
+            op.order.log_action(
+                "pretix_vacc_autosched.scheduled",
+                data=with_trace(
+                    {
+                        "position": op.pk,
+                        "event": event.pk,
+                        "event_slug": event.slug,
+                        "order": childorder.code,
+                    }
+                ),
+                save=False,
+            )
         )
-        childorder.log_action(
-            "pretix_vacc_autosched.created",
-            data={
-                "event": original_event.pk,
-                "event_slug": original_event.slug,
-                "order": op.order.code,
-            },
+        logentries.append(
+            childorder.log_action(
+                "pretix_vacc_autosched.created",
+                data=with_trace(
+                    {
+                        "event": original_event.pk,
+                        "event_slug": original_event.slug,
+                        "order": op.order.code,
+                    }
+                ),
+                save=False,
+            )
         )
-        childorder.log_action(
-            "pretix.event.order.placed", data={"source": "vacc_autosched"}
+        logentries.append(
+            childorder.log_action(
+                "pretix.event.order.placed",
+                data={"source": "vacc_autosched"},
+                save=False,
+            )
         )
         childpos = childorder.positions.create(
             positionid=1,
@@ -223,30 +682,338 @@ def book_second_dose(*, op, item, variation, subevent, original_event):
             voucher=None,
             meta_info=op.meta_info,
         )
-        for answ in op.answers.all():
-            q = childorder.event.questions.filter(
-                identifier=answ.question.identifier
-            ).first()
-            if not q:
-                continue
-            childansw = childpos.answers.create(
-                question=q, answer=answ.answer, file=answ.file
-            )
-            if answ.options.all():
-                childopts = list(
-                    q.options.filter(
-                        identifier__in=[o.identifier for o in answ.options.all()]
-                    )
+        if save_logs:
+            LogEntry.bulk_create_and_postprocess(logentries)
+    with phase(original_event, "copy_answers"):
+        copy_answers(
+            op,
+            childpos,
+            question_map if question_map is not None else get_question_map(event),
+        )
+    return childorder, childpos
+
+
+def book_second_dose(*, op, item, variation, subevent, original_event):
+    event = item.event
+    with span("book_second_dose", subevent=subevent.pk), transaction.atomic():
+        quotas = (variation or item)._get_quotas(subevent=subevent)
+        limited = [q for q in quotas if q.size is not None]
+        tokens = None
+        if (
+            limited
+            and uses_capacity_pool(original_event)
+            and len(get_pooled_quotas(limited)) == len(limited)
+        ):
+            # The seat is claimed from the pool instead of locking and checking the
+            # quotas, slots without a free seat left are skipped without waiting.
+            with phase(original_event, "lock_wait"):
+                tokens = claim_capacity_tokens(quotas)
+            if tokens is None:
+                logger.info(
+                    f"SECOND DOSE: cannot use slot {subevent.pk}, no free seat in pool"
+                )
+                return
+        else:
+            # Like pretix' own order creation, lock only the quotas we are going to use
+            # and hold a shared lock on the event, so bookings of other slots can run in
+            # parallel.
+            with phase(original_event, "lock_wait"):
+                lock_objects(limited, shared_lock_objects=[event])
+            with phase(original_event, "quota_check"):
+                avcode, avnr = (variation or item).check_quotas(
+                    subevent=subevent, fail_on_no_quotas=True
                 )
-                if childopts:
-                    childansw.options.add(*childopts)
+            if avcode != Quota.AVAILABILITY_OK:
+                logger.info(f"SECOND DOSE: cannot use slot {subevent.pk}, sold out")
+                store_slot_availability(subevent, item, variation, avcode, avnr)
+                # sold out, look for next one
+                return
 
-        LinkedOrderPosition.objects.create(base_position=op, child_position=childpos)
+        childorder, childpos = create_child_order(
+            op=op,
+            item=item,
+            variation=variation,
+            subevent=subevent,
+            original_event=original_event,
+        )
+        link = LinkedOrderPosition.objects.create(
+            base_position=op, child_position=childpos
+        )
         childorder.create_transactions(is_new=True)
+        if tokens is not None:
+            CapacityToken.objects.filter(pk__in=[t.pk for t in tokens]).update(
+                link=link
+            )
+            store_slot_availability(
+                subevent, item, variation, *get_pool_availability(quotas)
+            )
+        elif avnr is None:
+            store_slot_availability(subevent, item, variation, avcode, None)
+        else:
+            store_slot_availability(
+                subevent,
+                item,
+                variation,
+                Quota.AVAILABILITY_OK if avnr > 1 else Quota.AVAILABILITY_GONE,
+                avnr - 1,
+            )
+        messages = OutboxMessage.objects.bulk_create(
+            queue_second_dose_notifications(childorder, subevent, original_event)
+        )
+        on_commit_deliver_notifications(original_event, messages)
     order_placed.send(event, order=childorder)
     order_paid.send(event, order=childorder)
 
+    logger.info(f"SECOND DOSE: done, created order {childorder.code}")
+    return childorder
+
+
+class SecondDoseBookingError(Exception):
+    pass
+
+
+@app.task(base=SchedulingTask, bind=True, throws=(SecondDoseBookingError,))
+@traced
+@profiled
+def book_second_dose_async(self, event, op, subevent, item, variation=None):
+    """
+    Books the second dose for the position ``op`` of ``event`` in the time slot selected
+    on the self-service booking page. Returns the code of the new order or raises
+    ``SecondDoseBookingError`` if the time slot could not be booked.
+    """
+    if not claim_in_flight(op, self.request.id):
+        logger.info(f"SECOND DOSE: Scheduling of position {op} already in flight")
+        raise SecondDoseBookingError()
+
+    op = OrderPosition.objects.select_related(
+        "item__vacc_autosched_config__event", "variation", "subevent", "order"
+    ).get(pk=op, order__event=event)
+    if LinkedOrderPosition.objects.filter(base_position=op).exists():
+        logger.info("SECOND DOSE: Booking aborted, seond dose already booked")
+        raise SecondDoseBookingError()
+
+    target_event = op.item.vacc_autosched_config.event or event
+    target_item = target_event.items.get(pk=item)
+    try:
+        order = book_second_dose(
+            op=op,
+            item=target_item,
+            variation=target_item.variations.get(pk=variation) if variation else None,
+            subevent=target_event.subevents.get(pk=subevent),
+            original_event=event,
+        )
+    except LockTimeoutException:
+        logger.info(f"SECOND DOSE: cannot use slot {subevent}, lock timeout")
+        raise SecondDoseBookingError()
+    if not order:
+        raise SecondDoseBookingError()
+    return order.code
+
+
+def book_second_doses(*, target_event, bookings, original_event):
+    """
+    Books the second dose for many positions in ``target_event`` in one transaction that
+    locks all candidate quotas at once.
+    ``bookings`` is a list of ``(op, item, variation, earliest_date)`` tuples, which are
+    served in the given order. Slots are assigned from an in-memory model of the quota
+    availability that is computed once after the lock has been acquired. Returns a
+    dictionary mapping the IDs of the booked positions to their new orders.
+    """
+    earliest_dates = [b[3] for b in bookings]
+    subevents = list(
+        target_event.subevents.filter(
+            date_from__gte=min(earliest_dates), date_from__lt=max(earliest_dates)
+        ).order_by("date_from")
+    ) + list(
+        target_event.subevents.filter(date_from__gte=max(earliest_dates)).order_by(
+            "date_from"
+        )[:MAX_SUBEVENTS_CHECKED]
+    )
+    subevent_dates = [s.date_from for s in subevents]
+
+    booked = []
+    failed = []
+    capacity = SlotCapacity(subevents, {(b[1], b[2]) for b in bookings})
+    with transaction.atomic():
+        # With many quotas involved, lock_objects falls back to locking the whole event
+        with phase(original_event, "lock_wait"):
+            lock_objects(
+                [q for q in capacity.quota_objects if q.size is not None],
+                shared_lock_objects=[target_event],
+            )
+        with phase(original_event, "slot_search"):
+            capacity.compute()
+        question_map = get_question_map(target_event)
+
+        links = []
+        transactions = []
+        logentries = []
+        messages = []
+        tokens = []
+        pooled = (
+            get_pooled_quotas(capacity.quota_objects)
+            if uses_capacity_pool(original_event)
+            else set()
+        )
+        for op, item, variation, earliest_date in bookings:
+            start = bisect_left(subevent_dates, earliest_date)
+            end = start + MAX_SUBEVENTS_CHECKED
+            candidates = subevents[start:end]
+            subevent = claimed = None
+            for candidate in order_by_strategy(
+                candidates,
+                op.item.vacc_autosched_config,
+                earliest_date,
+                lambda s: capacity.fill_level(s, item, variation),
+            ):
+                if (
+                    capacity.availability(candidate, item, variation)[0]
+                    != Quota.AVAILABILITY_OK
+                ):
+                    continue
+                # Seats booked here must leave the pools of the quotas as well
+                claimed = claim_capacity_tokens(
+                    [
+                        q
+                        for q in capacity.get_quotas(candidate, item, variation)
+                        if q.pk in pooled
+                    ]
+                )
+                if claimed is None:
+                    continue
+                capacity.take(candidate, item, variation)
+                subevent = candidate
+                break
+            if not subevent:
+                failed.append((op, earliest_date, candidates))
+                continue
+
+            childorder, childpos = create_child_order(
+                op=op,
+                item=item,
+                variation=variation,
+                subevent=subevent,
+                original_event=original_event,
+                logentries=logentries,
+                question_map=question_map,
+            )
+            links.append(LinkedOrderPosition(base_position=op, child_position=childpos))
+            tokens.append(claimed)
+            transactions += childorder.create_transactions(
+                is_new=True, positions=[childpos], fees=[], save=False
+            )
+            messages += queue_second_dose_notifications(
+                childorder, subevent, original_event
+            )
+            booked.append((op, childorder))
+
+        LinkedOrderPosition.objects.bulk_create(links)
+        for claimed, link in zip(tokens, links):
+            for token in claimed:
+                token.link = link
+        CapacityToken.objects.bulk_update([t for c in tokens for t in c], ["link"])
+        Transaction.objects.bulk_create(transactions)
+        LogEntry.bulk_create_and_postprocess(logentries)
+        for item, variation, subevent in capacity.touched:
+            store_slot_availability(
+                subevent,
+                item,
+                variation,
+                *capacity.availability(subevent, item, variation),
+            )
+        messages = OutboxMessage.objects.bulk_create(messages)
+        on_commit_deliver_notifications(original_event, messages)
+
+    for op, earliest_date, candidates in failed:
+        log_no_slot_found(op, earliest_date, candidates)
+
+    for op, childorder in booked:
+        order_placed.send(target_event, order=childorder)
+        order_paid.send(target_event, order=childorder)
+        logger.info(f"SECOND DOSE: done, created order {childorder.code}")
+    return {op.pk: childorder for op, childorder in booked}
+
+
+def queue_second_dose_notifications(childorder, subevent, original_event):
+    """
+    Returns the unsaved outbox messages for a booked second dose, according to the
+    notification settings of ``original_event``.
+    """
+    messages = []
     if original_event.settings.vacc_autosched_mail:
+        messages.append(OutboxMessage.CHANNEL_EMAIL)
+    if (
+        original_event.settings.vacc_autosched_sms
+        and can_use_juvare_api(original_event)
+        and childorder.phone
+    ):
+        messages.append(OutboxMessage.CHANNEL_SMS)
+    return [
+        OutboxMessage(
+            event=original_event,
+            order=childorder,
+            subevent=subevent,
+            channel=channel,
+            trace=propagate(),
+        )
+        for channel in messages
+    ]
+
+
+def on_commit_deliver_notifications(event, messages):
+    if messages:
+        transaction.on_commit(
+            lambda: deliver_notifications.apply_async(
+                args=(event.pk, [m.pk for m in messages])
+            )
+        )
+
+
+@app.task(base=EventTask, bind=True, max_retries=5, default_retry_delay=60)
+@profiled
+def deliver_notifications(self, event, messages):
+    failed = []
+    for pk in messages:
+        with transaction.atomic():
+            message = (
+                OutboxMessage.objects.select_for_update(
+                    skip_locked=connection.features.has_select_for_update_skip_locked
+                )
+                .select_related("order", "order__event", "subevent")
+                .filter(pk=pk, event=event)
+                .first()
+            )
+            if not message:
+                continue  # already delivered, or being delivered by another worker
+            try:
+                with resume(
+                    message.trace, "deliver_notification", order=message.order.code
+                ):
+                    with phase(event, f"notify_{message.channel}"):
+                        # The savepoint keeps the transaction usable to record the
+                        # failed attempt, even if sending failed with a database error
+                        with transaction.atomic():
+                            send_second_dose_notification(message)
+            except Exception:
+                logger.exception(
+                    f"Second dose notification {message.pk} ({message.channel}) could not be sent"
+                )
+                message.attempts += 1
+                message.save(update_fields=["attempts"])
+                failed.append(pk)
+            else:
+                message.delete()
+
+    if failed:
+        # Anything left over after the last retry is picked up by the periodic redelivery
+        self.retry(args=(event.pk, failed))
+
+
+def send_second_dose_notification(message):
+    childorder = message.order
+    subevent = message.subevent
+    original_event = message.event
+    if message.channel == OutboxMessage.CHANNEL_EMAIL:
         with language(childorder.locale, original_event.settings.region):
             email_template = original_event.settings.vacc_autosched_body
             email_subject = str(original_event.settings.vacc_autosched_subject)
@@ -256,21 +1023,16 @@ def book_second_dose(*, op, item, variation, subevent, original_event):
                 subevent.date_from.astimezone(original_event.timezone),
                 "SHORT_DATETIME_FORMAT",
             )
-            try:
-                childorder.send_mail(
-                    email_subject,
-                    email_template,
-                    email_context,
-                    "pretix.event.order.email.order_placed",
-                    attach_tickets=True,
-                    attach_ical=event.settings.mail_attach_ical,
-                )
-            except SendMailException:
-                logger.exception("Order approved email could not be sent")
-    if (
-        original_event.settings.vacc_autosched_sms
-        and can_use_juvare_api(original_event)
-        and childorder.phone
+            childorder.send_mail(
+                email_subject,
+                email_template,
+                email_context,
+                "pretix.event.order.email.order_placed",
+                attach_tickets=True,
+                attach_ical=childorder.event.settings.mail_attach_ical,
+            )
+    elif message.channel == OutboxMessage.CHANNEL_SMS and can_use_juvare_api(
+        original_event
     ):
         with language(childorder.locale, original_event.settings.region):
             from pretix_juvare_notify.tasks import juvare_send_text
@@ -281,13 +1043,11 @@ def book_second_dose(*, op, item, variation, subevent, original_event):
                 subevent.date_from.astimezone(original_event.timezone),
                 "SHORT_DATETIME_FORMAT",
             )
-            message = str(template).format_map(TolerantDict(context))
+            text = str(template).format_map(TolerantDict(context))
             juvare_send_text.apply_async(
                 kwargs={
-                    "text": message,
+                    "text": text,
                     "to": childorder.phone,
                     "event": original_event.pk,
                 }
             )
-    logger.info(f"SECOND DOSE: done, created order {childorder.code}")
-    return childorder
@@ -0,0 +1,163 @@
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# The span code is currently running in, as a (trace id, span id) tuple
+_current = ContextVar("vacc_autosched_span", default=None)
+
+
+class JSONLinesExporter:
+    """
+    Appends every finished span as one line of JSON to the file at ``path``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+@functools.lru_cache(maxsize=None)
+def get_exporter():
+    """
+    Returns the callable finished spans are passed to, configured in the
+    ``[vacc_autosched]`` section of ``pretix.cfg``, or ``None`` if tracing is disabled.
+    ``trace_exporter`` is the dotted path of a callable that is called with the path set
+    as ``trace_file``, or ``None``, and returns the exporter. With only ``trace_file``
+    set, spans are written to that file as JSON lines.
+    """
+    path = settings.CONFIG_FILE.get("vacc_autosched", "trace_file", fallback="") or None
+    exporter = settings.CONFIG_FILE.get("vacc_autosched", "trace_exporter", fallback="")
+    if exporter:
+        return import_string(exporter)(path)
+    if path:
+        return JSONLinesExporter(path)
+    return None
+
+
+def export(span):
+    try:
+        get_exporter()(span)
+    except Exception:
+        logger.exception("Trace span could not be exported")
+
+
+def current_trace_id():
+    current = _current.get()
+    return current[0] if current else None
+
+
+def with_trace(data):
+    """
+    Returns the log entry ``data`` with the id of the current trace added, if any.
+    """
+    trace_id = current_trace_id()
+    return {**data, "trace": trace_id} if trace_id else data
+
+
+def propagate():
+    """
+    Returns the context to continue the current trace in a background task or stored
+    message with ``resume``, or ``None`` outside of a trace. It includes the time it was
+    created, so the time spent waiting in the queue is recorded as a separate span.
+    """
+    current = _current.get()
+    if not current:
+        return None
+    return {"trace": current[0], "parent": current[1], "sent": time.time()}
+
+
+@contextmanager
+def _span(trace_id, parent, name, attributes, start=None):
+    span_id = uuid.uuid4().hex[:16]
+    token = _current.set((trace_id, span_id))
+    start = start or time.time()
+    error = None
+    try:
+        yield span_id
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        end = time.time()
+        export(
+            {
+                "trace": trace_id,
+                "span": span_id,
+                "parent": parent,
+                "name": name,
+                "start": start,
+                "end": end,
+                "duration": end - start,
+                "error": error,
+                "attributes": attributes,
+            }
+        )
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """
+    Starts a new trace with a root span ``name`` around the block, if tracing is enabled.
+    """
+    if get_exporter() is None:
+        yield None
+        return
+    with _span(uuid.uuid4().hex, None, name, attributes) as span_id:
+        yield span_id
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Records the block as span ``name`` of the current trace, if there is one.
+    """
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    with _span(current[0], current[1], name, attributes) as span_id:
+        yield span_id
+
+
+@contextmanager
+def resume(context, name, **attributes):
+    """
+    Continues the trace of ``context``, as returned by ``propagate``, with a ``queued``
+    span for the time since the context was created and a span ``name`` around the block.
+    """
+    if not context or get_exporter() is None:
+        yield None
+        return
+    trace_id, parent = context["trace"], context["parent"]
+    with _span(trace_id, parent, "queued", {"task": name}, start=context["sent"]):
+        pass
+    with _span(trace_id, parent, name, attributes) as span_id:
+        yield span_id
+
+
+def traced(func):
+    """
+    Runs the decorated task in the trace passed as its ``trace`` keyword argument.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, trace=None, **kwargs):
+        with resume(trace, func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -1,7 +1,15 @@
 from django.urls import path, re_path
 
 from . import api
-from .views import SelfServiceBookingView, SelfServiceIndexView, SettingsView
+from .views import (
+    SelfServiceBookingView,
+    SelfServiceIndexView,
+    SelfServiceQueueView,
+    SelfServiceSlotsView,
+    SelfServiceStatusView,
+    SelfServiceThanksView,
+    SettingsView,
+)
 
 urlpatterns = [
     path(
@@ -17,6 +25,26 @@ urlpatterns = [
 ]
 
 event_patterns = [
+    path(
+        "2nd/queue/",
+        SelfServiceQueueView.as_view(),
+        name="second.queue",
+    ),
+    path(
+        "2nd/<str:order>/status/",
+        SelfServiceStatusView.as_view(),
+        name="second.status",
+    ),
+    path(
+        "2nd/<str:order>/thanks/",
+        SelfServiceThanksView.as_view(),
+        name="second.thanks",
+    ),
+    path(
+        "2nd/<str:order>/slots/",
+        SelfServiceSlotsView.as_view(),
+        name="second.slots",
+    ),
     path(
         "2nd/<str:order>/",
         SelfServiceBookingView.as_view(),
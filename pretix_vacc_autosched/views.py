@@ -1,27 +1,49 @@
 import datetime as dt
 import logging
+import math
 from django.contrib import messages
-from django.http import Http404
+from django.db.models import Prefetch
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils.formats import date_format
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
-from django.views.generic import FormView
-from pretix.base.models import Event, Quota
-from pretix.base.services.quotas import QuotaAvailability
+from django.views.generic import FormView, TemplateView, View
+from pretix.base.models import Event, OrderPosition
+from pretix.base.views.tasks import AsyncAction
 from pretix.control.views.event import EventSettingsFormView, EventSettingsViewMixin
+from pretix.helpers.http import redirect_to_url
 from pretix.multidomain.urlreverse import eventreverse
 from pretix.presale.views import EventViewMixin
 
+from pretix_vacc_autosched.availability import (
+    cached_availability,
+    get_available_days,
+    get_available_subevents,
+)
 from pretix_vacc_autosched.forms import (
     AutoschedSettingsForm,
     SecondDoseCodeForm,
     SecondDoseOrderForm,
 )
 from pretix_vacc_autosched.models import LinkedOrderPosition
-from pretix_vacc_autosched.tasks import get_for_other_event
+from pretix_vacc_autosched.profiling import profiled_view
+from pretix_vacc_autosched.routing import scheduling_options
+from pretix_vacc_autosched.tasks import (
+    SecondDoseBookingError,
+    book_second_dose_async,
+    get_for_other_event,
+)
+from pretix_vacc_autosched.tracing import propagate, start_trace
+from pretix_vacc_autosched.waitingroom import (
+    queue_position,
+    read_ticket,
+    ticket_cookie_name,
+    waiting_room,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +71,8 @@ class SelfServiceMixin:
         return super().dispatch(request, *args, **kwargs)
 
 
+@method_decorator(profiled_view, name="dispatch")
+@method_decorator(waiting_room, name="dispatch")
 class SelfServiceIndexView(SelfServiceMixin, EventViewMixin, FormView):
     form_class = SecondDoseCodeForm
     template_name = "pretix_vacc_autosched/self_service_index.html"
@@ -69,103 +93,83 @@ class SelfServiceIndexView(SelfServiceMixin, EventViewMixin, FormView):
         )
 
 
-class SelfServiceBookingView(SelfServiceMixin, EventViewMixin, FormView):
-    form_class = SecondDoseOrderForm
-    template_name = "pretix_vacc_autosched/self_service_order.html"
+class SecondDoseOrderMixin:
+    """
+    Resolves the order of the self-service URL and the window of time slots its second
+    dose can be booked in.
+    """
 
     @cached_property
     def order(self):
+        # Everything check_order() looks at is loaded here at once
         return (
             self.request.event.orders.filter(code=self.kwargs["order"])
             .select_related("event")
+            .prefetch_related(
+                Prefetch(
+                    "positions",
+                    queryset=OrderPosition.objects.select_related(
+                        "subevent",
+                        "item__vacc_autosched_config__event",
+                        "item__vacc_autosched_config__second_item",
+                        "variation",
+                    ).prefetch_related(
+                        Prefetch(
+                            "vacc_autosched_linked",
+                            queryset=LinkedOrderPosition.objects.select_related(
+                                "child_position__subevent"
+                            ),
+                        )
+                    ),
+                )
+            )
             .first()
         )
 
-    def dispatch(self, request, *args, **kwargs):
+    def check_order(self):
+        """
+        Returns an error message if no second dose can be booked for the order, otherwise
+        sets up the target product and ``self.window``, the subevents in which the second
+        dose may be booked.
+        """
         if not self.order:
-            messages.error(
-                request,
-                _(
-                    "We were unable to find a valid ticket with this code, please try again."
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
-                )
+            return _(
+                "We were unable to find a valid ticket with this code, please try again."
             )
 
         if self.order.status != self.order.STATUS_PAID or self.order.require_approval:
-            messages.error(
-                request,
-                _(
-                    "Scheduling of a second appointment is not available for this ticket since it has not yet been approved or has been canceled."
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
-                )
+            return _(
+                "Scheduling of a second appointment is not available for this ticket since it has not yet been approved or has been canceled."
             )
 
-        position = (
-            self.order.positions.first()
-        )  # We assume that there's only one position per order
+        # We assume that there's only one position per order
+        position = self.order.positions.all()[0]
         if (
             not position.subevent
             or not position.subevent.date_from.date() <= now().date()
         ):
-            messages.error(
-                request,
-                _(
-                    "Please do not try to schedule a second appointment before your first appointment is over."
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
-                )
+            return _(
+                "Please do not try to schedule a second appointment before your first appointment is over."
             )
 
         config = getattr(position.item, "vacc_autosched_config", None)
         if not config or not config.days or not position.subevent:
-            messages.error(
-                request,
-                _(
-                    "Scheduling of a second appointment is not available for this ticket."
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
-                )
+            return _(
+                "Scheduling of a second appointment is not available for this ticket."
             )
 
         self.position = position
-        link = LinkedOrderPosition.objects.filter(base_position=position).first()
+        link = next(iter(position.vacc_autosched_linked.all()), None)
         if link:
-            messages.error(
-                request,
-                _(
-                    "A second appointment has already been scheduled for {datetime}. "
-                    "The ticket has been sent to you via email to the address used for your first booking."
-                ).format(
-                    datetime=date_format(
-                        link.child_position.subevent.date_from.astimezone(
-                            self.request.event.timezone
-                        ),
-                        "DATETIME_FORMAT",
-                    )
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
+            return _(
+                "A second appointment has already been scheduled for {datetime}. "
+                "The ticket has been sent to you via email to the address used for your first booking."
+            ).format(
+                datetime=date_format(
+                    link.child_position.subevent.date_from.astimezone(
+                        self.request.event.timezone
+                    ),
+                    "DATETIME_FORMAT",
                 )
             )
 
@@ -175,68 +179,212 @@ class SelfServiceBookingView(SelfServiceMixin, EventViewMixin, FormView):
             days=config.max_days if config.max_days is not None else 1
         )
 
-        self.other_event = config.event or position.order.event
+        self.other_event = config.event or self.order.event
 
         self.target_item, self.target_variation = get_for_other_event(
             position, self.other_event, config.second_item
         )
-        subevents = self.other_event.subevents.filter(
+        if not self.target_item:
+            return _(
+                "Scheduling of a second appointment is not available for this ticket."
+            )
+        self.window = self.other_event.subevents.filter(
             date_from__date__gte=min_date,
             date_from__date__lte=max_date,
+        ).order_by("date_from")
+        self.cache_key = (
+            f"{self.other_event.pk}:{self.target_item.pk}:"
+            f"{self.target_variation.pk if self.target_variation else ''}"
+        )
+        self.window_key = f"{min_date.isoformat()}:{max_date.isoformat()}"
+
+    def get_days(self):
+        # Shared by everyone with the same window, e.g. after reminders went out at once
+        return cached_availability(
+            f"{self.cache_key}:days:{self.window_key}",
+            self.request.event.settings.vacc_autosched_self_service_cache_ttl,
+            lambda: get_available_days(
+                self.window, self.target_item, self.target_variation
+            ),
         )
-        quotas = Quota.objects.filter(
-            subevent__in=subevents, items__id=self.target_item.pk
+
+    def get_slots(self, day):
+        return cached_availability(
+            f"{self.cache_key}:slots:{self.window_key}:{day.isoformat()}",
+            self.request.event.settings.vacc_autosched_self_service_cache_ttl,
+            lambda: get_available_subevents(
+                self.window.filter(date_from__date=day),
+                self.target_item,
+                self.target_variation,
+            ),
         )
-        qa = QuotaAvailability()
-        qa.queue(*quotas)
-        qa.compute()
-        available_subevents = []
-        for subevent in subevents:
-            qlist = [q for q in quotas if q.subevent_id == subevent.pk]
-            if qlist and all(qa.results[q][0] == Quota.AVAILABILITY_OK for q in qlist):
-                available_subevents.append(subevent)
-
-        self.subevents = available_subevents
-
-        if not self.subevents:
-            messages.error(
-                request,
+
+
+class SelfServiceBookingTaskMixin(AsyncAction):
+    """
+    Runs the booking of the self-service page as a background task and reports its
+    result with the same messages as a booking made right away.
+    """
+
+    task = book_second_dose_async
+    known_errortypes = ["SecondDoseBookingError"]
+
+    def do(self, *args, **kwargs):
+        # Like AsyncAction.do, but the task is routed like all other scheduling tasks, so
+        # self-service bookings and check-ins into one series run on the same shard
+        options = scheduling_options(self.other_event.pk)
+        try:
+            res = self.task.apply_async(args=args, kwargs=kwargs, **options)
+        except ConnectionError:
+            # Task very likely not yet sent, e.g. because the broker is restarting
+            res = self.task.apply_async(args=args, kwargs=kwargs, **options)
+
+        if "ajax" in self.request.GET or "ajax" in self.request.POST:
+            data = self._return_ajax_result(res)
+            data["check_url"] = self.get_check_url(res.id, True)
+            return JsonResponse(data)
+        if res.ready():
+            if res.successful() and not isinstance(res.info, Exception):
+                return self.success(res.info)
+            return self.error(res.info)
+        return redirect_to_url(self.get_check_url(res.id, False))
+
+    def get_check_url(self, task_id, ajax):
+        return (
+            eventreverse(
+                self.request.event,
+                "plugins:pretix_vacc_autosched:second.status",
+                kwargs={"order": self.kwargs["order"]},
+            )
+            + "?async_id=%s" % task_id
+            + ("&ajax=1" if ajax else "")
+        )
+
+    def get_success_url(self, value):
+        return eventreverse(
+            self.request.event,
+            "plugins:pretix_vacc_autosched:second.thanks",
+            kwargs={"order": self.kwargs["order"]},
+        )
+
+    def get_error_url(self):
+        return eventreverse(
+            self.request.event,
+            "plugins:pretix_vacc_autosched:second.booking",
+            kwargs={"order": self.kwargs["order"]},
+        )
+
+    def get_success_message(self, value):
+        return _(
+            "Your appointment has been booked. We've sent you the details via email."
+        )
+
+    def get_error_message(self, exception):
+        if isinstance(exception, SecondDoseBookingError) or (
+            isinstance(exception, dict)
+            and exception.get("exc_type") in self.known_errortypes
+        ):
+            return _(
+                "There was an error when booking your second dose, please try again."
+            )
+        return super().get_error_message(exception)
+
+
+@method_decorator(profiled_view, name="dispatch")
+@method_decorator(waiting_room, name="dispatch")
+class SelfServiceBookingView(
+    SecondDoseOrderMixin,
+    SelfServiceMixin,
+    EventViewMixin,
+    SelfServiceBookingTaskMixin,
+    FormView,
+):
+    form_class = SecondDoseOrderForm
+    template_name = "pretix_vacc_autosched/self_service_order.html"
+
+    def redirect_with_error(self, message):
+        messages.error(self.request, message)
+        return redirect(
+            eventreverse(
+                self.request.event,
+                "plugins:pretix_vacc_autosched:second.index",
+            )
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        error = self.check_order()
+        if error:
+            return self.redirect_with_error(error)
+
+        # Only the days with available time slots are determined up front, the time slots
+        # themselves are loaded for one day at a time.
+        self.days = self.get_days()
+        if not self.days:
+            return self.redirect_with_error(
                 _(
                     "Unfortunately, there is currently no available slot for a second appointment."
-                ),
-            )
-            return redirect(
-                eventreverse(
-                    self.request.event,
-                    "plugins:pretix_vacc_autosched:second.index",
                 )
             )
 
         return super().dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        # Results of background bookings are polled on SelfServiceStatusView
+        return FormView.get(self, request, *args, **kwargs)
+
+    @cached_property
+    def selected_day(self):
+        day = self.request.GET.get("date")
+        for d in self.days:
+            if d.isoformat() == day:
+                return d
+        return self.days[0]
+
     def get_form_kwargs(self):
         result = super().get_form_kwargs()
         result["position"] = self.position
-        result["available_subevents"] = self.subevents
-        result["event"] = self.other_event
+        result["subevents"] = self.window
+        result["item"] = self.target_item
+        result["variation"] = self.target_variation
         return result
 
     def get_context_data(self, **kwargs):
         result = super().get_context_data(**kwargs)
         result["order"] = self.order
+        result["days"] = self.days
+        result["selected_day"] = self.selected_day
+        result["slots"] = self.get_slots(self.selected_day)
+        result["show_date_to"] = self.other_event.settings.show_date_to
         return result
 
     def form_valid(self, form):
         from .tasks import book_second_dose
 
         subevent = form.cleaned_data["subevent"]
-        order = book_second_dose(
-            op=self.position,
-            item=self.target_item,
-            variation=self.target_variation,
-            subevent=subevent,
-            original_event=self.request.event,
-        )
+        with start_trace(
+            "self_service_booking",
+            event=self.request.event.slug,
+            position=self.position.pk,
+        ):
+            if self.request.event.settings.vacc_autosched_self_service_async:
+                # The booking runs in a background task, the customer is redirected to a
+                # waiting page that polls its result.
+                return self.do(
+                    self.request.event.pk,
+                    self.position.pk,
+                    subevent.pk,
+                    self.target_item.pk,
+                    self.target_variation.pk if self.target_variation else None,
+                    trace=propagate(),
+                )
+
+            order = book_second_dose(
+                op=self.position,
+                item=self.target_item,
+                variation=self.target_variation,
+                subevent=subevent,
+                original_event=self.request.event,
+            )
         if order:
             messages.success(
                 self.request,
@@ -257,3 +405,97 @@ class SelfServiceBookingView(SelfServiceMixin, EventViewMixin, FormView):
                 ),
             )
             return self.form_invalid(form)
+
+
+@method_decorator(profiled_view, name="dispatch")
+@method_decorator(waiting_room, name="dispatch")
+class SelfServiceSlotsView(
+    SecondDoseOrderMixin, SelfServiceMixin, EventViewMixin, View
+):
+    """
+    Returns the available time slots of one day as JSON, used by the slot picker of the
+    booking page.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        error = self.check_order()
+        if error:
+            return JsonResponse({"error": str(error)}, status=404)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            day = dt.date.fromisoformat(request.GET.get("date", ""))
+        except ValueError:
+            return JsonResponse({"error": "Invalid date"}, status=400)
+
+        show_date_to = self.other_event.settings.show_date_to
+        return JsonResponse(
+            {
+                "date": day.isoformat(),
+                "slots": [
+                    {
+                        "id": subevent.pk,
+                        "date_from": subevent.date_from.isoformat(),
+                        "time": date_format(
+                            subevent.date_from.astimezone(self.other_event.timezone),
+                            "TIME_FORMAT",
+                        ),
+                        "time_to": (
+                            date_format(
+                                subevent.date_to.astimezone(self.other_event.timezone),
+                                "TIME_FORMAT",
+                            )
+                            if show_date_to and subevent.date_to
+                            else None
+                        ),
+                    }
+                    for subevent in self.get_slots(day)
+                ],
+            }
+        )
+
+
+@method_decorator(profiled_view, name="dispatch")
+class SelfServiceStatusView(
+    SelfServiceBookingTaskMixin, SelfServiceMixin, EventViewMixin, View
+):
+    """
+    Waiting page for bookings made in the background, which polls the result of the
+    booking task and redirects to the confirmation or back to the booking page.
+    """
+
+
+@method_decorator(profiled_view, name="dispatch")
+class SelfServiceThanksView(SelfServiceMixin, EventViewMixin, TemplateView):
+    template_name = "pretix_vacc_autosched/thanks.html"
+
+
+@method_decorator(profiled_view, name="dispatch")
+class SelfServiceQueueView(SelfServiceMixin, EventViewMixin, View):
+    """
+    Reports the position of a visitor in the waiting room as JSON, polled by the waiting
+    page until the visitor is admitted.
+    """
+
+    def get(self, request, *args, **kwargs):
+        rate = request.event.settings.vacc_autosched_waiting_room_rate
+        if not rate:
+            return JsonResponse({"admitted": True, "position": 0, "wait": 0})
+
+        ticket = read_ticket(
+            request.event, request.COOKIES.get(ticket_cookie_name(request.event))
+        )
+        if not ticket:
+            return JsonResponse({"error": "No queue ticket"}, status=400)
+
+        position = queue_position(request.event, rate, ticket)
+        response = JsonResponse(
+            {
+                "admitted": not position,
+                "position": position,
+                "wait": math.ceil(position / rate),
+            }
+        )
+        response["Cache-Control"] = "no-store"
+        return response
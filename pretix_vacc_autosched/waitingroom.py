@@ -0,0 +1,121 @@
+import math
+import time
+from django.core import signing
+from django.core.cache import cache
+from django.shortcuts import render
+from functools import wraps
+
+# Queue tickets are only accepted for this long after they were issued
+TICKET_MAX_AGE = 3600
+TICKET_SALT = "pretix_vacc_autosched.waitingroom"
+
+
+def ticket_cookie_name(event):
+    return f"vacc_autosched_queue_{event.pk}"
+
+
+def waiting_room_key(event, name):
+    return f"vacc_autosched:waitingroom:{event.pk}:{name}"
+
+
+def issue_ticket(event):
+    """
+    Draws the next number of the queue of ``event`` and returns a new queue ticket for it.
+    """
+    key = waiting_room_key(event, "issued")
+    cache.add(key, 0, None)
+    return {"event": event.pk, "number": cache.incr(key), "admitted": False}
+
+
+def read_ticket(event, value):
+    """
+    Returns the queue ticket of ``event`` signed into the cookie value ``value``, or
+    ``None`` if it is missing, forged, expired or belongs to another event.
+    """
+    if not value:
+        return None
+    try:
+        ticket = signing.loads(value, salt=TICKET_SALT, max_age=TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if not isinstance(ticket, dict) or ticket.get("event") != event.pk:
+        return None
+    return ticket
+
+
+def set_ticket_cookie(request, response, event, ticket):
+    response.set_cookie(
+        ticket_cookie_name(event),
+        signing.dumps(ticket, salt=TICKET_SALT),
+        max_age=TICKET_MAX_AGE,
+        secure=request.is_secure(),
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def admitted_until(event, rate):
+    """
+    Returns the highest queue number of ``event`` that has been admitted. Admission
+    advances by ``rate`` numbers per second. Admissions not used while nobody is waiting
+    are saved up for at most one second, so visitors arriving at an empty queue are let in
+    right away but a sudden crowd is not.
+
+    Concurrent callers may overwrite each other's update, which only shifts admission by
+    a fraction of a visitor.
+    """
+    key = waiting_room_key(event, "admitted")
+    issued = cache.get(waiting_room_key(event, "issued")) or 0
+    now = time.time()
+    # ``issued`` already counts the visitor asking, who is the first of the saved up ones
+    horizon, updated = cache.get(key) or (issued + rate - 1, now)
+    horizon = min(horizon + (now - updated) * rate, issued + rate - 1)
+    cache.set(key, (horizon, now), None)
+    return horizon
+
+
+def queue_position(event, rate, ticket):
+    """
+    Returns the number of visitors of ``event`` that are admitted before the holder of
+    ``ticket``, or 0 if the holder is admitted.
+    """
+    if ticket["admitted"]:
+        return 0
+    return max(math.ceil(ticket["number"] - admitted_until(event, rate)), 0)
+
+
+def waiting_room(view_func):
+    """
+    Lets visitors through to a self-service view only at the rate configured for the event
+    and shows everyone else a waiting page with their position in the queue. Visitors keep
+    their place through a signed queue ticket in a cookie, which is marked as admitted once
+    they are let in.
+    """
+
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        event = request.event
+        rate = event.settings.vacc_autosched_waiting_room_rate
+        if not rate:
+            return view_func(request, *args, **kwargs)
+
+        ticket = read_ticket(event, request.COOKIES.get(ticket_cookie_name(event)))
+        if ticket and ticket["admitted"]:
+            return view_func(request, *args, **kwargs)
+
+        ticket = ticket or issue_ticket(event)
+        position = queue_position(event, rate, ticket)
+        if position:
+            response = render(
+                request,
+                "pretix_vacc_autosched/waiting_room.html",
+                {"position": position, "wait": math.ceil(position / rate)},
+            )
+            response["Cache-Control"] = "no-store"
+        else:
+            ticket["admitted"] = True
+            response = view_func(request, *args, **kwargs)
+        set_ticket_cookie(request, response, event, ticket)
+        return response
+
+    return wrapped
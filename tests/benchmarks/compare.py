@@ -0,0 +1,46 @@
+"""
+Compares two result files of the benchmark suite::
+
+    python tests/benchmarks/compare.py benchmark-old.json benchmark-new.json
+"""
+
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data, {r["name"]: r for r in data["results"]}
+
+
+def main(old_path, new_path):
+    old, old_results = load(old_path)
+    new, new_results = load(new_path)
+    for label, data in (("old", old), ("new", new)):
+        print(f"{label}: {data['database']}, pretix {data['pretix']}, {data['scale']}")
+
+    print(
+        f"{'benchmark':45} {'median old':>11} {'median new':>11} {'change':>8} {'queries':>11}"
+    )
+    for name, result in new_results.items():
+        before = old_results.get(name)
+        if "median" not in result:
+            continue
+        if not before:
+            print(f"{name:45} {'':>11} {result['median'] * 1000:>9.1f}ms")
+            continue
+        change = (result["median"] - before["median"]) / before["median"] * 100
+        queries = (
+            f"{before['queries_min']:>5}→{result['queries_min']:<5}"
+            if "queries_min" in result and "queries_min" in before
+            else ""
+        )
+        print(
+            f"{name:45} {before['median'] * 1000:>9.1f}ms {result['median'] * 1000:>9.1f}ms "
+            f"{change:>+7.1f}% {queries}"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,212 @@
+import datetime as dt
+import json
+import os
+import platform
+import pytest
+import statistics
+import time
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix import __version__ as pretix_version
+from pretix.base.models import Order, OrderPosition, Question, QuestionAnswer
+
+from pretix_vacc_autosched.codes import update_code_lookup
+
+# Size of the synthetic event series, can be changed through the environment
+SUBEVENTS = int(os.environ.get("VACC_AUTOSCHED_BENCHMARK_SUBEVENTS", 200))
+SEATS = int(os.environ.get("VACC_AUTOSCHED_BENCHMARK_SEATS", 5))
+QUESTIONS = int(os.environ.get("VACC_AUTOSCHED_BENCHMARK_QUESTIONS", 5))
+ORDERS = int(os.environ.get("VACC_AUTOSCHED_BENCHMARK_ORDERS", 50))
+ROUNDS = int(os.environ.get("VACC_AUTOSCHED_BENCHMARK_ROUNDS", 10))
+
+RESULTS = []
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not RESULTS:
+        return
+    path = os.environ.get("VACC_AUTOSCHED_BENCHMARK_OUTPUT") or (
+        f"benchmark-{connection.vendor}-{now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "created": now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "pretix": pretix_version,
+                "scale": {
+                    "subevents": SUBEVENTS,
+                    "seats": SEATS,
+                    "questions": QUESTIONS,
+                    "orders": ORDERS,
+                },
+                "results": RESULTS,
+            },
+            f,
+            indent=2,
+        )
+    session.config.get_terminal_writer().line(f"Benchmark results written to {path}")
+
+
+@pytest.fixture(autouse=True)
+def local_cache(settings):
+    # Production setups serve settings and availability from a cache, the test settings
+    # do not cache anything at all
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def benchmark_results():
+    """
+    Results recorded through this list are written to the result file of the session.
+    """
+    return RESULTS
+
+
+@pytest.fixture
+def benchmark():
+    """
+    Runs ``func`` ``ROUNDS`` times, but at most ``limit`` times, and records the wall-clock
+    time and the number of queries of each run. ``setup`` is called before each run outside
+    of the measurement, and its result is passed to ``func``.
+    """
+
+    def run(name, func, setup=None, limit=None, **params):
+        rounds = min(ROUNDS, limit) if limit else ROUNDS
+        timings = []
+        queries = []
+        for i in range(rounds):
+            args = setup() if setup else ()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                func(*args)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(ctx.captured_queries))
+        result = {
+            "name": name,
+            "params": params,
+            "rounds": rounds,
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "max": max(timings),
+            "queries_min": min(queries),
+            "queries_max": max(queries),
+        }
+        RESULTS.append(result)
+        return result
+
+    return run
+
+
+def create_orders(event, item, subevents, answers=()):
+    """
+    Creates a paid order with one position for every entry of ``subevents`` in bulk, with
+    an answer for every question in ``answers``.
+    """
+    channel = event.organizer.sales_channels.get(identifier="web")
+    orders = Order.objects.bulk_create(
+        [
+            Order(
+                event=event,
+                organizer=event.organizer,
+                code=get_random_string(10, "ABCDEFGHJKLMNPQRSTUVWXYZ3789"),
+                status=Order.STATUS_PAID,
+                email="patient@example.org",
+                datetime=now(),
+                expires=now() + dt.timedelta(days=3),
+                total=Decimal("0.00"),
+                locale="en",
+                sales_channel=channel,
+            )
+            for s in subevents
+        ]
+    )
+    positions = OrderPosition.objects.bulk_create(
+        [
+            OrderPosition(
+                order=order,
+                organizer=event.organizer,
+                item=item,
+                subevent=subevent,
+                price=Decimal("0.00"),
+                tax_rate=Decimal("0.00"),
+                tax_value=Decimal("0.00"),
+                positionid=1,
+                secret=get_random_string(32),
+                pseudonymization_id=get_random_string(16),
+            )
+            for order, subevent in zip(orders, subevents)
+        ]
+    )
+    QuestionAnswer.objects.bulk_create(
+        [
+            QuestionAnswer(orderposition=position, question=question, answer="Answer")
+            for position in positions
+            for question in answers
+        ]
+    )
+    return orders, positions
+
+
+@pytest.fixture
+def build_series(event, item):
+    """
+    Builds a synthetic event series with ``subevents`` time slots for the second dose,
+    each with a quota of ``seats``, of which the first ``fill`` fraction is sold out, and
+    ``orders`` first-dose orders with ``QUESTIONS`` answered questions. Returns the time
+    slots and the first-dose positions.
+    """
+
+    @scopes_disabled()
+    def build(fill=0.0, subevents=SUBEVENTS, orders=ORDERS, seats=SEATS):
+        questions = [
+            Question.objects.create(
+                event=event,
+                question=f"Question {i}",
+                type=Question.TYPE_STRING,
+                identifier=f"Q{i}",
+            )
+            for i in range(QUESTIONS)
+        ]
+        for question in questions:
+            question.items.add(item)
+
+        start = now() + dt.timedelta(days=21)
+        slots = []
+        for i in range(subevents):
+            subevent = event.subevents.create(
+                name="Slot",
+                date_from=start + dt.timedelta(minutes=15 * i),
+                active=True,
+            )
+            quota = event.quotas.create(name="Slot", size=seats, subevent=subevent)
+            quota.items.add(item)
+            slots.append(subevent)
+
+        sold_out = slots[: int(subevents * fill)]
+        create_orders(event, item, [s for s in sold_out for seat in range(seats)])
+
+        first_dose = event.subevents.create(
+            name="First dose", date_from=now() - dt.timedelta(hours=1), active=True
+        )
+        created, positions = create_orders(
+            event, item, [first_dose] * orders, answers=questions
+        )
+        update_code_lookup(
+            Order.objects.filter(pk__in=[o.pk for o in created]).prefetch_related(
+                "all_positions"
+            )
+        )
+        return slots, positions
+
+    return build
@@ -0,0 +1,121 @@
+import os
+import pytest
+from django.test import Client
+from django_scopes import scope, scopes_disabled
+from pretix.base.models import OrderPosition
+
+from pretix_vacc_autosched.forms import SecondDoseCodeForm
+from pretix_vacc_autosched.tasks import book_second_dose, schedule_second_dose
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(
+        not os.environ.get("VACC_AUTOSCHED_BENCHMARK"),
+        reason="set VACC_AUTOSCHED_BENCHMARK=1 to run the benchmarks",
+    ),
+]
+
+FILL_LEVELS = {"empty": 0.0, "half_full": 0.5, "nearly_sold_out": 0.95}
+
+
+def booking_url(position):
+    order = position.order
+    return f"/{order.event.organizer.slug}/{order.event.slug}/2nd/{order.code}/"
+
+
+def first_doses(positions):
+    """
+    Hands out the first-dose positions one by one, loaded like the scheduling task does.
+    """
+    remaining = iter(positions)
+
+    @scopes_disabled()
+    def next_position():
+        return (
+            OrderPosition.objects.select_related(
+                "item", "variation", "subevent", "order"
+            ).get(pk=next(remaining).pk),
+        )
+
+    return next_position
+
+
+@pytest.mark.parametrize("fill", FILL_LEVELS.keys())
+def test_schedule_second_dose(benchmark, build_series, event, fill):
+    slots, positions = build_series(FILL_LEVELS[fill])
+    benchmark(
+        f"schedule_second_dose[{fill}]",
+        lambda op: schedule_second_dose.apply(args=(event.pk, op.pk), throw=True),
+        setup=first_doses(positions),
+        limit=len(positions),
+        fill=FILL_LEVELS[fill],
+    )
+    with scopes_disabled():
+        assert positions[0].vacc_autosched_linked.exists()
+
+
+def test_book_second_dose(benchmark, build_series, event, item):
+    slots, positions = build_series()
+    free_slots = iter(slots)
+
+    @scopes_disabled()
+    def book(op):
+        assert book_second_dose(
+            op=op,
+            item=item,
+            variation=None,
+            subevent=next(free_slots),
+            original_event=event,
+        )
+
+    benchmark(
+        "book_second_dose",
+        book,
+        setup=first_doses(positions),
+        limit=min(len(positions), len(slots)),
+    )
+
+
+def test_code_form(benchmark, build_series, event):
+    slots, positions = build_series()
+    codes = [p.order.code.lower() for p in positions] + [p.secret for p in positions]
+
+    def clean(code):
+        with scope(organizer=event.organizer):
+            form = SecondDoseCodeForm(event, data={"order": code})
+            assert form.is_valid(), form.errors
+
+    benchmark(
+        "SecondDoseCodeForm.clean_order",
+        clean,
+        setup=lambda: (codes.pop(),),
+        limit=len(codes),
+    )
+
+
+def test_booking_view_get(benchmark, build_series):
+    slots, positions = build_series()
+    client = Client()
+    url = booking_url(positions[0])
+
+    def get():
+        assert client.get(url).status_code == 200
+
+    benchmark("SelfServiceBookingView.get", get)
+
+
+def test_booking_view_post(benchmark, build_series):
+    slots, positions = build_series()
+    client = Client()
+    bookings = iter(zip(positions, slots))
+
+    def post(position, subevent):
+        response = client.post(booking_url(position), data={"subevent": subevent.pk})
+        assert response.status_code == 200
+
+    benchmark(
+        "SelfServiceBookingView.post",
+        post,
+        setup=lambda: next(bookings),
+        limit=min(len(positions), len(slots)),
+    )
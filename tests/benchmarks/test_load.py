@@ -0,0 +1,280 @@
+import logging
+import os
+import pytest
+import random
+import re
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.db.models import Count
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from http.cookiejar import CookieJar
+from pretix.base.models import Checkin, Order, OrderPosition
+from pretix.base.services.locking import LockTimeoutException
+from pretix.base.signals import checkin_created
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, build_opener
+
+from pretix_vacc_autosched import tasks
+from pretix_vacc_autosched.models import LinkedOrderPosition
+
+logger = logging.getLogger(__name__)
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(
+        not os.environ.get("VACC_AUTOSCHED_LOAD"),
+        reason="set VACC_AUTOSCHED_LOAD=1 to run the load test",
+    ),
+]
+
+# Simulated scheduling workers, each processing check-ins one after another
+WORKERS = int(os.environ.get("VACC_AUTOSCHED_LOAD_WORKERS", 20))
+CHECKINS = int(os.environ.get("VACC_AUTOSCHED_LOAD_CHECKINS", 200))
+# Simulated customers booking through the self-service at the same time
+USERS = int(os.environ.get("VACC_AUTOSCHED_LOAD_USERS", 200))
+# Fewer seats than customers, so the end of the run competes for the last ones
+SLOTS = int(os.environ.get("VACC_AUTOSCHED_LOAD_SLOTS", 60))
+SEATS = int(os.environ.get("VACC_AUTOSCHED_LOAD_SEATS", 5))
+
+RE_CSRF = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+RE_SLOT = re.compile(r'name="subevent" value="(\d+)"')
+
+
+def summarize(timings, wall):
+    timings = sorted(timings)
+    if len(timings) < 2:
+        timings = timings * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "rounds": len(timings),
+        "throughput": len(timings) / wall if wall else None,
+        "min": timings[0],
+        "median": cuts[49],
+        "p95": cuts[94],
+        "p99": cuts[98],
+        "max": timings[-1],
+    }
+
+
+class LoadRecorder:
+    """
+    Collects timings and outcomes from all threads of the load test. On SQLite, which
+    does not support concurrent writers, all operations are run one after another, so
+    only the correctness checks are meaningful there.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.outcomes = Counter()
+        self.lock_waits = []
+        self.serial = threading.Lock() if connection.vendor == "sqlite" else None
+        self._lock = threading.Lock()
+
+    def measure(self, name, func, *args):
+        if self.serial:
+            self.serial.acquire()
+        try:
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.timings.setdefault(name, []).append(
+                        time.perf_counter() - start
+                    )
+        finally:
+            if self.serial:
+                self.serial.release()
+
+    def count(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = LoadRecorder()
+
+    def timed_lock_objects(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return lock_objects(*args, **kwargs)
+        except LockTimeoutException:
+            recorder.count("lock_timeout")
+            raise
+        finally:
+            recorder.lock_waits.append(time.perf_counter() - start)
+
+    def counted_retry_countdown(retries):
+        recorder.count("task_retry")
+        return retry_countdown(retries)
+
+    lock_objects = tasks.lock_objects
+    retry_countdown = tasks.retry_countdown
+    monkeypatch.setattr(tasks, "lock_objects", timed_lock_objects)
+    monkeypatch.setattr(tasks, "retry_countdown", counted_retry_countdown)
+    return recorder
+
+
+def check_in(recorder, event, checkin_list, position):
+    @scopes_disabled()
+    def scan():
+        checkin = Checkin.objects.create(
+            position=position, list=checkin_list, datetime=now()
+        )
+        checkin_created.send(event, checkin=checkin)
+
+    try:
+        recorder.measure("checkin", scan)
+    except Exception:
+        logger.exception("Check-in failed")
+        recorder.count("checkin_error")
+    finally:
+        connection.close()
+
+
+def book_self_service(recorder, base_url, order):
+    opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(name, url, data=None):
+        def send():
+            try:
+                with opener.open(
+                    url, data=urlencode(data).encode() if data else None, timeout=60
+                ) as response:
+                    return response.read().decode()
+            except HTTPError as e:
+                recorder.count(f"http_{e.code}")
+                return ""
+
+        return recorder.measure(name, send)
+
+    start = time.perf_counter()
+    page = request("index", base_url)
+    csrf = RE_CSRF.search(page).group(1)
+    page = request("code", base_url, {"csrfmiddlewaretoken": csrf, "order": order.code})
+    slots = RE_SLOT.findall(page)
+    if not slots:
+        recorder.count("user_no_slot")
+        return
+    page = request(
+        "booking",
+        f"{base_url}{order.code}/",
+        {
+            "csrfmiddlewaretoken": RE_CSRF.search(page).group(1),
+            # Pick one of the first slots like most people would
+            "subevent": random.choice(slots[:3]),
+        },
+    )
+    recorder.count(
+        "user_booked" if "Your appointment has been booked" in page else "user_failed"
+    )
+    with recorder._lock:
+        recorder.timings.setdefault("user_flow", []).append(time.perf_counter() - start)
+
+
+@scopes_disabled()
+def assert_consistent(event, slots, seats):
+    overbooked = {
+        s.pk: n
+        for s, n in (
+            (
+                s,
+                OrderPosition.objects.filter(
+                    subevent=s,
+                    order__status__in=(Order.STATUS_PAID, Order.STATUS_PENDING),
+                ).count(),
+            )
+            for s in slots
+        )
+        if n > seats
+    }
+    duplicates = list(
+        LinkedOrderPosition.objects.values("base_position")
+        .annotate(n=Count("id"))
+        .filter(n__gt=1)
+        .values_list("base_position", "n")
+    )
+    assert not overbooked, f"Overbooked time slots: {overbooked}"
+    assert not duplicates, f"Positions scheduled more than once: {duplicates}"
+
+
+def test_checkin_burst_with_self_service(
+    live_server,
+    settings,
+    capsys,
+    event,
+    build_series,
+    recorder,
+    benchmark_results,
+):
+    settings.SITE_URL = live_server.url
+    event.settings.vacc_autosched_checkin = True
+    slots, positions = build_series(
+        subevents=SLOTS, orders=CHECKINS + USERS, seats=SEATS
+    )
+    with scopes_disabled():
+        checkin_list = event.checkin_lists.create(name="Entry", all_products=True)
+    checkin_positions, user_positions = positions[:CHECKINS], positions[CHECKINS:]
+    base_url = f"{live_server.url}/{event.organizer.slug}/{event.slug}/2nd/"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(WORKERS) as workers:
+        with ThreadPoolExecutor(max(USERS, 1)) as users:
+            jobs = [
+                workers.submit(check_in, recorder, event, checkin_list, p)
+                for p in checkin_positions
+            ] + [
+                users.submit(book_self_service, recorder, base_url, p.order)
+                for p in user_positions
+            ]
+            for job in jobs:
+                job.result()
+    wall = time.perf_counter() - start
+
+    params = {
+        "database": connection.vendor,
+        "serialized": recorder.serial is not None,
+        "workers": WORKERS,
+        "checkins": CHECKINS,
+        "users": USERS,
+        "slots": SLOTS,
+        "seats": SEATS,
+    }
+    results = [
+        {"name": f"load[{name}]", "params": params, **summarize(timings, wall)}
+        for name, timings in sorted(recorder.timings.items())
+    ]
+    results.append(
+        {
+            "name": "load[lock_wait]",
+            "params": params,
+            "total": sum(recorder.lock_waits),
+            **summarize(recorder.lock_waits, wall),
+        }
+    )
+    results.append(
+        {"name": "load[outcomes]", "params": params, "wall": wall, **recorder.outcomes}
+    )
+    benchmark_results.extend(results)
+
+    with capsys.disabled():
+        print(
+            f"\nLoad test on {connection.vendor} in {wall:.1f}s: {dict(recorder.outcomes)}"
+        )
+        for r in results[:-1]:
+            print(
+                f"{r['name']:20} {r['rounds']:>6} ops {r['throughput'] or 0:>8.1f}/s "
+                f"p50 {r['median'] * 1000:>8.1f}ms p95 {r['p95'] * 1000:>8.1f}ms "
+                f"p99 {r['p99'] * 1000:>8.1f}ms"
+            )
+
+    assert_consistent(event, slots, SEATS)
+    with scopes_disabled():
+        assert LinkedOrderPosition.objects.count() <= SLOTS * SEATS
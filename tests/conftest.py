@@ -1 +1,102 @@
-# put your pytest fixtures here
+import datetime as dt
+import pytest
+from decimal import Decimal
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, Order, OrderPosition, Organizer
+
+from pretix_vacc_autosched.models import ItemConfig
+
+
+@pytest.fixture
+@scopes_disabled()
+def organizer():
+    return Organizer.objects.create(name="Vaccination Center", slug="vacc")
+
+
+@pytest.fixture
+@scopes_disabled()
+def event(organizer):
+    event = Event.objects.create(
+        organizer=organizer,
+        name="Vaccination",
+        slug="vacc",
+        date_from=now(),
+        has_subevents=True,
+        live=True,
+        plugins="pretix_vacc_autosched",
+    )
+    event.settings.vacc_autosched_self_service = True
+    return event
+
+
+@pytest.fixture
+@scopes_disabled()
+def item(event):
+    item = event.items.create(name="Vaccination", default_price=0)
+    ItemConfig.objects.create(item=item, days=21, max_days=42)
+    return item
+
+
+@pytest.fixture
+def make_slots(event, item):
+    """
+    Creates ``n`` hourly time slots with a quota of ``size`` for the second dose, starting
+    21 days from now or after the slots created before.
+    """
+    created = []
+
+    @scopes_disabled()
+    def make(n, size=1):
+        slots = []
+        for i in range(n):
+            subevent = event.subevents.create(
+                name="Slot",
+                date_from=now() + dt.timedelta(days=21, hours=len(created)),
+                active=True,
+            )
+            quota = event.quotas.create(name="Slot", size=size, subevent=subevent)
+            quota.items.add(item)
+            slots.append(subevent)
+            created.append(subevent)
+        return slots
+
+    return make
+
+
+@pytest.fixture
+def make_position(event, item):
+    """
+    Creates a paid order with one position of ``item`` (or ``variation``) in ``subevent``.
+    """
+
+    @scopes_disabled()
+    def make(subevent, item=item, variation=None):
+        order = Order.objects.create(
+            event=event,
+            status=Order.STATUS_PAID,
+            email="patient@example.org",
+            expires=now() + dt.timedelta(days=3),
+            total=Decimal("0.00"),
+            locale="en",
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        )
+        return OrderPosition.objects.create(
+            order=order,
+            item=item,
+            variation=variation,
+            subevent=subevent,
+            price=Decimal("0.00"),
+            positionid=1,
+        )
+
+    return make
+
+
+@pytest.fixture
+@scopes_disabled()
+def first_dose(event, make_position):
+    subevent = event.subevents.create(
+        name="First dose", date_from=now() - dt.timedelta(hours=1), active=True
+    )
+    return make_position(subevent)
@@ -0,0 +1,276 @@
+import datetime as dt
+import pytest
+import threading
+import time
+from contextlib import nullcontext
+from django.core.cache import cache
+from django.db import connection
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Order, OrderPosition, Quota
+from pretix.base.services.orders import cancel_order
+
+from pretix_vacc_autosched import availability, signals, tasks
+from pretix_vacc_autosched.availability import (
+    get_slot_availability,
+    reconcile_capacity_tokens,
+)
+from pretix_vacc_autosched.models import (
+    CapacityToken,
+    LinkedOrderPosition,
+    SlotAvailability,
+)
+from pretix_vacc_autosched.tasks import schedule_second_dose
+
+
+def indexed(subevent):
+    with scopes_disabled():
+        row = SlotAvailability.objects.get(subevent=subevent)
+        return row.availability, row.available_number
+
+
+@pytest.mark.django_db
+def test_index_updated_by_booking(event, item, first_dose, make_slots):
+    slots = make_slots(2, size=2)
+    with scopes_disabled():
+        rows = get_slot_availability(slots, item, None)
+        assert {s: (r.availability, r.available_number) for s, r in rows.items()} == {
+            s.pk: (Quota.AVAILABILITY_OK, 2) for s in slots
+        }
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_OK, 1)
+    assert indexed(slots[1]) == (Quota.AVAILABILITY_OK, 2)
+
+
+@pytest.mark.django_db
+def test_booking_not_refreshed_again(
+    event, first_dose, make_slots, monkeypatch, django_capture_on_commit_callbacks
+):
+    make_slots(1, size=2)
+    refreshed = []
+    monkeypatch.setattr(
+        tasks.refresh_slot_availability_index,
+        "apply_async",
+        lambda args: refreshed.append(args),
+    )
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        assert LinkedOrderPosition.objects.exists()
+    # The booking stored the new availability of the slot already
+    assert refreshed == []
+
+
+@pytest.mark.django_db
+def test_index_invalidated(
+    event, item, first_dose, make_slots, django_capture_on_commit_callbacks
+):
+    slots = make_slots(1)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        childorder = LinkedOrderPosition.objects.get().child_position.order
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_GONE, 0)
+
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        quota = event.quotas.get(subevent=slots[0])
+        quota.size = 5
+        quota.save()
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_OK, 4)
+
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        cancel_order(childorder.pk)
+        assert Order.objects.get(pk=childorder.pk).status == Order.STATUS_CANCELED
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_OK, 5)
+
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        quota.items.remove(item)
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_GONE, 0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_capacity_pool_shared_quota(event, item, make_position, monkeypatch):
+    monkeypatch.setattr(tasks, "uses_capacity_pool", lambda event: True)
+    # Concurrent bookings do not see the pools reconciled after each other's commits
+    monkeypatch.setattr(signals, "refresh_availability_on_commit", lambda *args: None)
+    with scopes_disabled():
+        variations = [item.variations.create(value=v) for v in ("A", "B")]
+        slot = event.subevents.create(
+            name="Slot", date_from=now() + dt.timedelta(days=21), active=True
+        )
+        quota = event.quotas.create(name="Slot", size=2, subevent=slot)
+        quota.items.add(item)
+        quota.variations.add(*variations)
+        # Both variations claim seats from the pool of the shared quota
+        reconcile_capacity_tokens([quota])
+        assert CapacityToken.objects.count() == 2
+
+        first = event.subevents.create(
+            name="First dose", date_from=now() - dt.timedelta(hours=1), active=True
+        )
+        positions = [
+            make_position(first, variation=variation)
+            for variation in variations
+            for i in range(3)
+        ]
+
+    # SQLite does not support concurrent writers
+    serial = threading.Lock() if connection.vendor == "sqlite" else None
+    booked = []
+    locked = []
+    monkeypatch.setattr(
+        tasks, "lock_objects", lambda *args, **kwargs: locked.append(args)
+    )
+
+    @scopes_disabled()
+    def book(op):
+        try:
+            with serial or nullcontext():
+                op = OrderPosition.objects.select_related(
+                    "item", "variation", "subevent", "order"
+                ).get(pk=op.pk)
+                if tasks.book_second_dose(
+                    op=op,
+                    item=item,
+                    variation=op.variation,
+                    subevent=slot,
+                    original_event=event,
+                ):
+                    booked.append(op)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=book, args=(op,)) for op in positions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(booked) == 2
+    # The pool is the only capacity check, the quotas are neither locked nor checked
+    assert locked == []
+    with scopes_disabled():
+        assert OrderPosition.objects.filter(subevent=slot).count() == 2
+        assert CapacityToken.objects.filter(link__isnull=False).count() == 2
+        assert not CapacityToken.objects.filter(link__isnull=True).exists()
+
+
+@pytest.mark.django_db
+def test_capacity_pool_not_reconciled(
+    event, item, first_dose, make_slots, make_position, monkeypatch
+):
+    monkeypatch.setattr(tasks, "uses_capacity_pool", lambda event: True)
+    slots = make_slots(2, size=2)
+    with scopes_disabled():
+        reconcile_capacity_tokens(event.quotas.filter(subevent=slots[1]))
+        # The first slot has no pool yet, e.g. because it was just created
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        link = LinkedOrderPosition.objects.get()
+        assert link.child_position.subevent == slots[0]
+        assert not link.capacity_tokens.exists()
+
+        # In slots with a pool, the booking claims a seat from it
+        second = make_position(first_dose.subevent)
+        tasks.book_second_dose(
+            op=second,
+            item=item,
+            variation=None,
+            subevent=slots[1],
+            original_event=event,
+        )
+        link = LinkedOrderPosition.objects.get(base_position=second)
+        assert link.capacity_tokens.get().quota.subevent == slots[1]
+    assert indexed(slots[0]) == (Quota.AVAILABILITY_OK, 1)
+    assert indexed(slots[1]) == (Quota.AVAILABILITY_OK, 1)
+
+
+@pytest.mark.django_db
+def test_capacity_pool_reconciled(event, first_dose, make_slots):
+    slots = make_slots(2, size=2)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        tasks.reconcile_capacity_pool.apply(args=(event.pk,), throw=True)
+        assert {
+            s: CapacityToken.objects.filter(quota__subevent=s).count() for s in slots
+        } == {slots[0]: 1, slots[1]: 2}
+        # Free seats of a quota that was made smaller are removed from its pool
+        event.quotas.filter(subevent=slots[1]).update(size=1)
+        tasks.refresh_slot_availability_index.apply(
+            args=(event.pk, [slots[1].pk]), throw=True
+        )
+        assert CapacityToken.objects.filter(quota__subevent=slots[1]).count() == 1
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    yield
+    cache.clear()
+
+
+def test_cached_availability_hit(locmem_cache):
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return ["slot"]
+
+    assert availability.cached_availability("day", 10, compute) == ["slot"]
+    assert availability.cached_availability("day", 10, compute) == ["slot"]
+    assert availability.cached_availability("other", 10, compute) == ["slot"]
+    assert len(computed) == 2
+
+
+def test_cached_availability_disabled(locmem_cache):
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return ["slot"]
+
+    assert availability.cached_availability("day", 0, compute) == ["slot"]
+    assert availability.cached_availability("day", 0, compute) == ["slot"]
+    assert len(computed) == 2
+
+
+def test_cached_availability_single_flight(locmem_cache):
+    computing, done = threading.Event(), threading.Event()
+    results, waiter_computed = [], []
+
+    def compute():
+        computing.set()
+        done.wait(5)
+        return ["slot"]
+
+    def compute_again():
+        waiter_computed.append(1)
+        return ["other"]
+
+    holder = threading.Thread(
+        target=lambda: results.append(
+            availability.cached_availability("day", 10, compute)
+        )
+    )
+    holder.start()
+    computing.wait(5)
+    waiter = threading.Thread(
+        target=lambda: results.append(
+            availability.cached_availability("day", 10, compute_again)
+        )
+    )
+    waiter.start()
+    time.sleep(0.2)
+    done.set()
+    holder.join()
+    waiter.join()
+
+    # The waiting request gets the result of the one that computed it
+    assert results == [["slot"], ["slot"]]
+    assert waiter_computed == []
+
+
+def test_cached_availability_wait_timeout(locmem_cache, monkeypatch):
+    monkeypatch.setattr(availability, "SINGLE_FLIGHT_WAIT", 0.2)
+    # Another request is computing the result, but does not finish in time
+    cache.add("vacc_autosched:availability:day:lock", True, 10)
+    assert availability.cached_availability("day", 10, lambda: ["slot"]) == ["slot"]
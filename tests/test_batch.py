@@ -0,0 +1,177 @@
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Checkin, Quota, Transaction
+from pretix.base.signals import checkin_created
+
+from pretix_vacc_autosched import tasks
+from pretix_vacc_autosched.availability import (
+    get_slot_availability,
+    reconcile_capacity_tokens,
+)
+from pretix_vacc_autosched.models import (
+    LinkedOrderPosition,
+    SchedulingQueueEntry,
+    SlotAvailability,
+)
+
+
+@pytest.mark.django_db
+def test_batch_booking(event, first_dose, make_slots, make_position):
+    slots = make_slots(4)
+    positions = [first_dose] + [make_position(first_dose.subevent) for i in range(4)]
+    call_command("vacc_autosched_schedule", *[str(p.pk) for p in positions])
+
+    with scopes_disabled():
+        links = list(LinkedOrderPosition.objects.select_related("child_position"))
+        assert {link.base_position_id for link in links} == {
+            p.pk for p in positions[:4]
+        }
+        assert {link.child_position.subevent for link in links} == set(slots)
+        assert (
+            Transaction.objects.filter(
+                order__in=[link.child_position.order_id for link in links]
+            ).count()
+            == 4
+        )
+        assert (
+            positions[4]
+            .order.all_logentries()
+            .filter(action_type="pretix_vacc_autosched.failed")
+            .exists()
+        )
+
+    # Positions that already have a second dose are skipped
+    call_command("vacc_autosched_schedule", *[str(p.pk) for p in positions])
+    with scopes_disabled():
+        assert LinkedOrderPosition.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_batch_outcomes(event, first_dose, make_slots, make_position, monkeypatch):
+    make_slots(1)
+    with scopes_disabled():
+        late = make_position(
+            event.subevents.create(
+                name="Late", date_from=first_dose.subevent.date_from.replace(year=2100)
+            )
+        )
+    outcomes = []
+    monkeypatch.setattr(
+        tasks,
+        "observe_scheduling",
+        lambda event, outcome, started, iterations=0: outcomes.append(outcome),
+    )
+    # The first position in the batch finds no slot, the second one is booked
+    with scopes_disabled():
+        tasks.schedule_second_doses.apply(
+            args=(event.pk, [late.pk, first_dose.pk]), throw=True
+        )
+        assert LinkedOrderPosition.objects.get().base_position == first_dose
+    assert sorted(outcomes) == ["scheduled", "sold_out"]
+
+
+@pytest.mark.django_db
+def test_batch_claims_tokens(
+    event, item, first_dose, make_slots, make_position, monkeypatch
+):
+    monkeypatch.setattr(tasks, "uses_capacity_pool", lambda event: True)
+    slots = make_slots(3)
+    with scopes_disabled():
+        get_slot_availability(slots, item, None)
+        reconcile_capacity_tokens(event.quotas.filter(subevent__in=slots[:2]))
+        # The pool of the first slot is used up, even though its quota was extended
+        # since it was reconciled
+        tasks.book_second_dose(
+            op=make_position(first_dose.subevent),
+            item=item,
+            variation=None,
+            subevent=slots[0],
+            original_event=event,
+        )
+        event.quotas.filter(subevent=slots[0]).update(size=2)
+        tasks.schedule_second_doses.apply(
+            args=(event.pk, [first_dose.pk, make_position(first_dose.subevent).pk]),
+            throw=True,
+        )
+
+        link = LinkedOrderPosition.objects.get(base_position=first_dose)
+        assert link.child_position.subevent == slots[1]
+        assert link.capacity_tokens.get().quota.subevent == slots[1]
+        # The third slot has no pool yet, its quota is checked instead
+        third = LinkedOrderPosition.objects.get(child_position__subevent=slots[2])
+        assert not third.capacity_tokens.exists()
+        row = SlotAvailability.objects.get(subevent=slots[0])
+        assert (row.availability, row.available_number) == (Quota.AVAILABILITY_GONE, 0)
+
+
+@pytest.fixture
+def batches(event, settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    event.settings.vacc_autosched_checkin = True
+    event.settings.vacc_autosched_batch = True
+    event.settings.vacc_autosched_batch_size = 3
+    yield
+    cache.clear()
+
+
+def check_in(event, position):
+    checkin = Checkin.objects.create(
+        position=position,
+        list=event.checkin_lists.get_or_create(name="Entry", all_products=True)[0],
+        datetime=now(),
+    )
+    checkin_created.send(event, checkin=checkin)
+
+
+@pytest.mark.django_db
+def test_checkins_coalesced(
+    event,
+    first_dose,
+    make_slots,
+    make_position,
+    batches,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+):
+    make_slots(5)
+    positions = [first_dose] + [make_position(first_dose.subevent) for i in range(4)]
+    flushes = []
+    monkeypatch.setattr(
+        tasks.flush_scheduling_queue,
+        "apply_async",
+        lambda args, countdown=None: flushes.append(countdown),
+    )
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        for position in positions:
+            check_in(event, position)
+
+    # One delayed flush for the first check-in, one immediate flush for the full batch
+    assert flushes == [30, None]
+    with scopes_disabled():
+        assert SchedulingQueueEntry.objects.count() == 5
+        monkeypatch.undo()
+        tasks.flush_scheduling_queue.apply(args=(event.pk,), throw=True)
+        assert not SchedulingQueueEntry.objects.exists()
+        assert LinkedOrderPosition.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_flush_keeps_entries_on_broker_error(
+    event, first_dose, batches, monkeypatch, django_capture_on_commit_callbacks
+):
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=False):
+        check_in(event, first_dose)
+
+    def fail(*args, **kwargs):
+        raise ConnectionError()
+
+    monkeypatch.setattr(tasks.schedule_second_doses, "apply_async", fail)
+    with scopes_disabled():
+        with pytest.raises(ConnectionError):
+            tasks.flush_scheduling_queue.apply(args=(event.pk,), throw=True)
+        assert SchedulingQueueEntry.objects.get().position == first_dose
@@ -0,0 +1,62 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import Order
+
+from pretix_vacc_autosched import tasks
+from pretix_vacc_autosched.codes import find_order, update_code_lookup
+from pretix_vacc_autosched.forms import SecondDoseCodeForm
+
+
+def clean(event, code):
+    form = SecondDoseCodeForm(event, data={"order": code})
+    form.is_valid()
+    return form.cleaned_data.get("order")
+
+
+@pytest.mark.django_db
+def test_code_lookup(event, first_dose):
+    order = first_dose.order
+    call_command("vacc_autosched_build_code_lookup")
+    with scopes_disabled():
+        for code in (
+            order.code.lower(),
+            order.secret.upper(),
+            f" {first_dose.secret.upper()} ",
+        ):
+            assert clean(event, code) == order
+
+        with CaptureQueriesContext(connection) as ctx:
+            assert clean(event, "unknown") is None
+        # Once all orders are indexed, a miss does not search the orders
+        assert not [
+            q
+            for q in ctx.captured_queries
+            if f'FROM "{Order._meta.db_table}"' in q["sql"]
+        ]
+
+
+@pytest.mark.django_db
+def test_fallback_until_backfilled(event, first_dose, make_position, monkeypatch):
+    backfills = []
+    monkeypatch.setattr(
+        tasks.backfill_code_lookup,
+        "apply_async",
+        lambda args: backfills.append(args),
+    )
+    with scopes_disabled():
+        # Only some orders of the event are in the lookup table yet
+        indexed = make_position(first_dose.subevent).order
+        update_code_lookup([indexed])
+        assert clean(event, indexed.code) == indexed
+        assert not backfills
+
+        assert clean(event, first_dose.order.code.lower()) == first_dose.order
+        assert backfills == [(event.pk,)]
+
+        monkeypatch.undo()
+        tasks.backfill_code_lookup.apply(args=(event.pk,), throw=True)
+        assert event.settings.vacc_autosched_codes_backfilled
+        assert find_order(event, first_dose.order.code) == first_dose.order
@@ -0,0 +1,83 @@
+import pytest
+from collections import Counter
+from django_scopes import scopes_disabled
+
+from pretix_vacc_autosched import metrics
+from pretix_vacc_autosched.tasks import schedule_second_dose
+
+
+@pytest.fixture
+def recorded(settings, monkeypatch):
+    settings.METRICS_ENABLED = True
+    recorded = Counter()
+
+    def observe(metric):
+        def record(value, **labels):
+            recorded[(metric.name, *sorted(labels.items()))] += 1
+
+        return record
+
+    for metric in (
+        metrics.vacc_autosched_phase_duration_seconds,
+        metrics.vacc_autosched_scheduling_duration_seconds,
+        metrics.vacc_autosched_slot_search_iterations,
+    ):
+        monkeypatch.setattr(metric, "observe", observe(metric))
+    monkeypatch.setattr(
+        metrics.vacc_autosched_scheduling_total,
+        "inc",
+        observe(metrics.vacc_autosched_scheduling_total),
+    )
+    return recorded
+
+
+def outcomes(recorded):
+    return {
+        dict(labels)["outcome"]: n
+        for (name, *labels), n in recorded.items()
+        if name == "pretix_vacc_autosched_scheduling_total"
+    }
+
+
+def phases(recorded):
+    return {
+        dict(labels)["phase"]
+        for (name, *labels), n in recorded.items()
+        if name == "pretix_vacc_autosched_phase_duration_seconds"
+    }
+
+
+@pytest.mark.django_db
+def test_scheduling_metrics(event, first_dose, make_slots, recorded):
+    make_slots(2)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+
+    assert outcomes(recorded) == {"scheduled": 1, "already_scheduled": 1}
+    assert {
+        "resolve_product",
+        "slot_search",
+        "lock_wait",
+        "quota_check",
+        "create_order",
+        "copy_answers",
+    } <= phases(recorded)
+
+
+@pytest.mark.django_db
+def test_scheduling_metrics_sold_out(event, first_dose, recorded):
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+
+    assert outcomes(recorded) == {"sold_out": 1}
+
+
+@pytest.mark.django_db
+def test_no_metrics_when_disabled(event, first_dose, make_slots, recorded, settings):
+    settings.METRICS_ENABLED = False
+    make_slots(1)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+
+    assert not recorded
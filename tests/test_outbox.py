@@ -0,0 +1,81 @@
+import datetime as dt
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.signals import periodic_task
+
+from pretix_vacc_autosched import tasks
+from pretix_vacc_autosched.models import OutboxMessage
+
+
+@pytest.fixture
+def notifications(event, first_dose, make_slots, make_position):
+    """
+    Books the second dose of two positions and returns the outbox messages queued for
+    them, without delivering them.
+    """
+    event.settings.vacc_autosched_mail = True
+    make_slots(2)
+    second = make_position(first_dose.subevent)
+    with scopes_disabled():
+        for position in (first_dose, second):
+            tasks.schedule_second_dose.apply(args=(event.pk, position.pk), throw=True)
+        return list(OutboxMessage.objects.order_by("pk"))
+
+
+@pytest.mark.django_db
+def test_delivered_after_commit(
+    event, first_dose, make_slots, mailoutbox, django_capture_on_commit_callbacks
+):
+    event.settings.vacc_autosched_mail = True
+    make_slots(1)
+    with scopes_disabled():
+        with django_capture_on_commit_callbacks() as callbacks:
+            tasks.schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        assert OutboxMessage.objects.count() == 1
+        assert not mailoutbox
+
+        for callback in callbacks:
+            callback()
+        assert not OutboxMessage.objects.exists()
+    assert len(mailoutbox) == 1
+
+
+@pytest.mark.django_db
+def test_failed_delivery(event, notifications, mailoutbox, monkeypatch):
+    send = tasks.send_second_dose_notification
+    retried = []
+
+    def fail_first(message):
+        if message.pk == notifications[0].pk:
+            raise ValueError("Invalid template")
+        send(message)
+
+    monkeypatch.setattr(tasks, "send_second_dose_notification", fail_first)
+    monkeypatch.setattr(
+        tasks.deliver_notifications, "retry", lambda args: retried.append(args)
+    )
+    with scopes_disabled():
+        tasks.deliver_notifications.apply(
+            args=(event.pk, [m.pk for m in notifications]), throw=True
+        )
+        assert list(OutboxMessage.objects.values_list("pk", "attempts")) == [
+            (notifications[0].pk, 1)
+        ]
+    assert len(mailoutbox) == 1
+    assert retried == [(event.pk, [notifications[0].pk])]
+
+
+@pytest.mark.django_db
+def test_redelivery(event, notifications, mailoutbox):
+    with scopes_disabled():
+        OutboxMessage.objects.update(created=now() - dt.timedelta(minutes=15))
+        OutboxMessage.objects.filter(pk=notifications[0].pk).update(
+            attempts=tasks.OUTBOX_MAX_ATTEMPTS
+        )
+        periodic_task.send(None)
+        # Messages that failed too often are given up on
+        assert list(OutboxMessage.objects.values_list("pk", flat=True)) == [
+            notifications[0].pk
+        ]
+    assert len(mailoutbox) == 1
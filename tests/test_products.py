@@ -0,0 +1,114 @@
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Checkin, Event, OrderPosition
+
+from pretix_vacc_autosched.models import ItemConfig, TargetProduct
+from pretix_vacc_autosched.products import get_configured_items
+from pretix_vacc_autosched.signals import checkin_created_receiver
+from pretix_vacc_autosched.tasks import get_for_other_event
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    """
+    Must be requested before ``event``, as the event's cache keeps the backend it was
+    first used with.
+    """
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+@scopes_disabled()
+def other_event(organizer):
+    return Event.objects.create(
+        organizer=organizer,
+        name="Second dose",
+        slug="second",
+        date_from=now(),
+        has_subevents=True,
+    )
+
+
+@pytest.mark.django_db
+def test_target_product_mapping(
+    item, first_dose, other_event, django_capture_on_commit_callbacks
+):
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        target = other_event.items.create(name="Vaccination", default_price=0)
+        other_event.items.create(name="Other", default_price=0)
+        config = item.vacc_autosched_config
+        config.event = other_event
+        config.save()
+    with scopes_disabled():
+        assert TargetProduct.objects.get().target_item == target
+        op = OrderPosition.objects.select_related("item", "order__event").get(
+            pk=first_dose.pk
+        )
+        assert get_for_other_event(op, other_event, None) == (target, None)
+
+    # A second product with the same name makes the mapping ambiguous
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        duplicate = other_event.items.create(name="Vaccination", default_price=0)
+    with scopes_disabled():
+        assert TargetProduct.objects.get().failure == TargetProduct.FAILURE_ITEM
+        assert get_for_other_event(op, other_event, None) == (None, None)
+
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        duplicate.delete()
+    with scopes_disabled():
+        assert TargetProduct.objects.get().target_item == target
+
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        target.name = "Renamed"
+        target.save()
+    with scopes_disabled():
+        assert TargetProduct.objects.get().failure == TargetProduct.FAILURE_ITEM
+
+
+@pytest.mark.django_db
+def test_unmapped_products_ignored(item, other_event, locmem_cache):
+    with scopes_disabled():
+        product = other_event.items.create(name="Vaccination", default_price=0)
+        with CaptureQueriesContext(connection) as ctx:
+            product.save()
+    assert not [
+        q for q in ctx.captured_queries if ItemConfig._meta.db_table in q["sql"]
+    ]
+
+
+@pytest.mark.django_db
+def test_configured_items_cached(
+    locmem_cache,
+    event,
+    item,
+    first_dose,
+    make_position,
+    django_capture_on_commit_callbacks,
+):
+    with scopes_disabled():
+        other = event.items.create(name="Other", default_price=0)
+        position = make_position(first_dose.subevent, item=other)
+        checkin = Checkin(
+            position=position, list=event.checkin_lists.create(name="Entry")
+        )
+        event = Event.objects.get(pk=event.pk)
+        checkin_created_receiver(event, checkin)
+        # Check-ins of products without a configuration cost no query
+        with CaptureQueriesContext(connection) as ctx:
+            checkin_created_receiver(event, checkin)
+        assert not ctx.captured_queries
+
+        with django_capture_on_commit_callbacks(execute=True):
+            ItemConfig.objects.create(item=other, days=21)
+        assert get_configured_items(event) == {item.pk: event.pk, other.pk: event.pk}
+        with django_capture_on_commit_callbacks(execute=True):
+            other.vacc_autosched_config.delete()
+        assert get_configured_items(event) == {item.pk: event.pk}
@@ -0,0 +1,69 @@
+import logging
+import pytest
+from configparser import ConfigParser
+from django_scopes import scopes_disabled
+
+from pretix_vacc_autosched.tasks import schedule_second_dose
+
+
+@pytest.fixture
+def profile_config(settings):
+    def configure(**options):
+        config = ConfigParser()
+        config.read_dict(
+            {"vacc_autosched": {f"profile_{k}": str(v) for k, v in options.items()}}
+        )
+        settings.CONFIG_FILE = config
+
+    return configure
+
+
+def profile_warnings(caplog):
+    return [
+        r.vacc_autosched_profile
+        for r in caplog.records
+        if r.name == "pretix_vacc_autosched.profiling"
+    ]
+
+
+@pytest.mark.django_db
+def test_slow_task_reported(event, first_dose, make_slots, profile_config, caplog):
+    profile_config(sample_rate=1, max_queries=5)
+    make_slots(3)
+    with scopes_disabled(), caplog.at_level(logging.WARNING):
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+
+    # Tasks called from within a profiled task are not reported on their own
+    (report,) = profile_warnings(caplog)
+    assert report["operation"] == "schedule_second_dose"
+    assert report["queries"] > 5
+    assert all(r["count"] > 1 for r in report["repeated"])
+
+
+@pytest.mark.django_db
+def test_view_within_thresholds(client, first_dose, make_slots, profile_config, caplog):
+    make_slots(1)
+    profile_config(sample_rate=1, max_queries=1000, max_db_time=60)
+    order = first_dose.order
+    with caplog.at_level(logging.WARNING):
+        response = client.get(
+            f"/{order.event.organizer.slug}/{order.event.slug}/2nd/{order.code}/"
+        )
+    assert response.status_code == 200
+    assert not profile_warnings(caplog)
+
+    profile_config(sample_rate=1, max_queries=1)
+    with caplog.at_level(logging.WARNING):
+        client.get(
+            f"/{order.event.organizer.slug}/{order.event.slug}/2nd/{order.code}/"
+        )
+    assert [r["operation"] for r in profile_warnings(caplog)] == ["second.booking"]
+
+
+@pytest.mark.django_db
+def test_not_sampled(event, first_dose, make_slots, profile_config, caplog):
+    profile_config(sample_rate=0, max_queries=0)
+    make_slots(1)
+    with scopes_disabled(), caplog.at_level(logging.WARNING):
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+    assert not profile_warnings(caplog)
@@ -0,0 +1,87 @@
+import pytest
+from configparser import ConfigParser
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Checkin
+from pretix.base.signals import checkin_created
+
+from pretix_vacc_autosched import signals, tasks
+from pretix_vacc_autosched.models import LinkedOrderPosition
+from pretix_vacc_autosched.routing import get_scheduling_queue
+
+
+@pytest.fixture
+def shards(settings):
+    def configure(n, **options):
+        config = ConfigParser()
+        config.read_dict({"vacc_autosched": {"shards": str(n), **options}})
+        settings.CONFIG_FILE = config
+
+    return configure
+
+
+def test_no_sharding():
+    assert get_scheduling_queue(1) is None
+
+
+def test_rendezvous_hashing(shards):
+    shards(4)
+    before = {pk: get_scheduling_queue(pk) for pk in range(200)}
+    assert set(before.values()) == {f"vacc_autosched_{i}" for i in range(4)}
+
+    # Only the events assigned to the new shard move
+    shards(5)
+    after = {pk: get_scheduling_queue(pk) for pk in range(200)}
+    assert {after[pk] for pk in before if after[pk] != before[pk]} == {
+        "vacc_autosched_4"
+    }
+
+    shards(5, queue_prefix="vaccination")
+    assert get_scheduling_queue(1) == after[1].replace("vacc_autosched", "vaccination")
+
+
+@pytest.mark.django_db
+def test_checkin_routed(event, item, first_dose, shards, monkeypatch):
+    shards(4)
+    event.settings.vacc_autosched_checkin = True
+    dispatched = []
+    monkeypatch.setattr(
+        signals.schedule_second_dose,
+        "apply_async",
+        lambda **kwargs: dispatched.append(kwargs.get("queue")),
+    )
+    with scopes_disabled():
+        checkin = Checkin.objects.create(
+            position=first_dose,
+            list=event.checkin_lists.create(name="Entry", all_products=True),
+            datetime=now(),
+        )
+        checkin_created.send(event, checkin=checkin)
+    assert dispatched == [get_scheduling_queue(event.pk)]
+
+
+@pytest.mark.django_db
+def test_self_service_booking_routed(
+    client, event, first_dose, make_slots, shards, monkeypatch
+):
+    shards(4)
+    event.settings.vacc_autosched_self_service_async = True
+    slots = make_slots(1)
+    dispatched = []
+    task = tasks.book_second_dose_async
+    apply_async = task.apply_async
+
+    def record(**kwargs):
+        dispatched.append(kwargs.get("queue"))
+        return apply_async(**kwargs)
+
+    monkeypatch.setattr(task, "apply_async", record)
+    order = first_dose.order
+    response = client.post(
+        f"/{event.organizer.slug}/{event.slug}/2nd/{order.code}/",
+        data={"subevent": slots[0].pk},
+    )
+    assert response.status_code == 302
+    assert dispatched == [get_scheduling_queue(event.pk)]
+    with scopes_disabled():
+        assert LinkedOrderPosition.objects.filter(base_position=first_dose).exists()
@@ -0,0 +1,277 @@
+import pytest
+from celery.exceptions import Retry
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition, Question, QuestionAnswer
+from pretix.base.services.locking import LockTimeoutException
+
+from pretix_vacc_autosched import tasks
+from pretix_vacc_autosched.models import ItemConfig, LinkedOrderPosition
+from pretix_vacc_autosched.tasks import book_second_dose, schedule_second_dose
+
+
+def scheduled_slot(position):
+    with scopes_disabled():
+        link = LinkedOrderPosition.objects.filter(base_position=position).first()
+        return link.child_position.subevent if link else None
+
+
+@pytest.mark.django_db
+def test_earliest_available_slot(event, first_dose, make_slots, make_position):
+    slots = make_slots(3)
+    make_position(slots[0])
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+    assert scheduled_slot(first_dose) == slots[1]
+
+
+@pytest.mark.django_db
+def test_no_slot_available(event, first_dose, make_slots, make_position):
+    slots = make_slots(2)
+    for slot in slots:
+        make_position(slot)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        assert scheduled_slot(first_dose) is None
+        assert (
+            first_dose.order.all_logentries()
+            .filter(action_type="pretix_vacc_autosched.failed")
+            .exists()
+        )
+
+
+@pytest.mark.django_db
+def test_slot_search_queries_constant(event, first_dose, make_slots, make_position):
+    slots = make_slots(2)
+    make_position(slots[0])
+    with scopes_disabled(), CaptureQueriesContext(connection) as few:
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+    assert scheduled_slot(first_dose) == slots[1]
+
+    # The availability of all sold out slots before the free one is checked at once
+    slots = make_slots(21)
+    for slot in slots[:20]:
+        make_position(slot)
+    second = make_position(first_dose.subevent)
+    with scopes_disabled(), CaptureQueriesContext(connection) as many:
+        schedule_second_dose.apply(args=(event.pk, second.pk), throw=True)
+    assert scheduled_slot(second) == slots[20]
+    assert len(many) == len(few)
+
+
+def answer_questions(event, position, n):
+    for i in range(n):
+        question = event.questions.get_or_create(
+            identifier=f"Q{i}",
+            defaults={"question": f"Q{i}", "type": Question.TYPE_CHOICE_MULTIPLE},
+        )[0]
+        options = [
+            question.options.get_or_create(identifier=f"Q{i}{a}", answer=a)[0]
+            for a in "AB"
+        ]
+        answer = QuestionAnswer.objects.create(
+            orderposition=position, question=question, answer="A, B"
+        )
+        answer.options.add(*options)
+
+
+@pytest.mark.django_db
+def test_answers_copied_in_bulk(event, item, first_dose, make_slots, make_position):
+    slots = make_slots(2)
+    second = make_position(first_dose.subevent)
+    with scopes_disabled():
+        answer_questions(event, first_dose, 2)
+        answer_questions(event, second, 20)
+
+        counts = []
+        for position, slot in zip((first_dose, second), slots):
+            op = OrderPosition.objects.select_related(
+                "item", "variation", "subevent", "order"
+            ).get(pk=position.pk)
+            with CaptureQueriesContext(connection) as ctx:
+                childorder = book_second_dose(
+                    op=op,
+                    item=item,
+                    variation=None,
+                    subevent=slot,
+                    original_event=event,
+                )
+            counts.append(len(ctx))
+
+        childpos = childorder.positions.get()
+        assert {a.question.identifier: a.answer for a in childpos.answers.all()} == {
+            f"Q{i}": "A, B" for i in range(20)
+        }
+        assert {
+            o.identifier for a in childpos.answers.all() for o in a.options.all()
+        } == {f"Q{i}{a}" for i in range(20) for a in "AB"}
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.django_db
+def test_locks_quotas_of_slot(event, first_dose, make_slots, monkeypatch):
+    slots = make_slots(2)
+    locked = []
+
+    def lock_objects(objects, *, shared_lock_objects=()):
+        locked.append((list(objects), list(shared_lock_objects)))
+        return original(objects, shared_lock_objects=shared_lock_objects)
+
+    original = tasks.lock_objects
+    monkeypatch.setattr(tasks, "lock_objects", lock_objects)
+    with scopes_disabled():
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+        assert locked == [([event.quotas.get(subevent=slots[0])], [event])]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("batch", [False, True])
+def test_least_filled_slot(event, item, first_dose, make_slots, make_position, batch):
+    with scopes_disabled():
+        config = item.vacc_autosched_config
+        config.strategy = ItemConfig.STRATEGY_LEAST_FILLED
+        config.save()
+    half_full = make_slots(1, size=4)[0]
+    empty = make_slots(1, size=1)[0]
+    for i in range(2):
+        make_position(half_full)
+
+    # The empty slot has fewer free seats, but a smaller share of them is taken
+    with scopes_disabled():
+        if batch:
+            tasks.schedule_second_doses.apply(
+                args=(event.pk, [first_dose.pk]), throw=True
+            )
+        else:
+            schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+    assert scheduled_slot(first_dose) == empty
+
+
+@pytest.mark.django_db
+def test_retry_resumes_search(event, item, first_dose, make_slots, monkeypatch):
+    slots = make_slots(3)
+    tried = []
+    retried = {}
+
+    def book_second_dose(**kwargs):
+        tried.append(kwargs["subevent"])
+        if len(tried) == 1:
+            return None  # sold out in the meantime
+        raise LockTimeoutException()
+
+    def retry(**kwargs):
+        retried.update(kwargs)
+        raise Retry()
+
+    monkeypatch.setattr(tasks, "book_second_dose", book_second_dose)
+    monkeypatch.setattr(tasks.schedule_second_dose, "retry", retry)
+    with scopes_disabled(), pytest.raises(Retry):
+        schedule_second_dose.apply(args=(event.pk, first_dose.pk), throw=True)
+
+    assert tried == slots[:2]
+    assert retried["args"] == (event.pk, first_dose.pk)
+    assert retried["kwargs"] == {
+        "target": (item.pk, None),
+        "checked": [slots[0].pk],
+        "trace": None,
+    }
+    assert tasks.RETRY_BACKOFF_BASE / 2 <= retried["countdown"]
+    assert retried["countdown"] <= tasks.RETRY_BACKOFF_BASE
+
+    # The retry skips the slots that were found to be sold out
+    monkeypatch.undo()
+    with scopes_disabled():
+        schedule_second_dose.apply(
+            args=retried["args"], kwargs=retried["kwargs"], throw=True
+        )
+    assert scheduled_slot(first_dose) == slots[1]
+
+
+def test_retry_countdown():
+    for retries in range(10):
+        delay = min(tasks.RETRY_BACKOFF_BASE * 2**retries, tasks.RETRY_BACKOFF_MAX)
+        countdowns = [tasks.retry_countdown(retries) for i in range(20)]
+        assert all(delay / 2 <= c <= delay for c in countdowns)
+        # Jittered, so tasks that failed together do not retry together
+        assert len(set(countdowns)) > 1
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    yield
+    cache.clear()
+
+
+def in_flight(position):
+    return cache.get(tasks.in_flight_key(position.pk))
+
+
+@pytest.mark.django_db
+def test_in_flight_deduplication(event, first_dose, make_slots, locmem_cache):
+    make_slots(1)
+    assert tasks.claim_in_flight(first_dose.pk, "first")
+    assert not tasks.claim_in_flight(first_dose.pk, "second")
+
+    with scopes_disabled():
+        schedule_second_dose.apply(
+            args=(event.pk, first_dose.pk), task_id="second", throw=True
+        )
+        assert scheduled_slot(first_dose) is None
+        assert in_flight(first_dose) == "first"
+
+        schedule_second_dose.apply(
+            args=(event.pk, first_dose.pk), task_id="first", throw=True
+        )
+        assert scheduled_slot(first_dose)
+        assert in_flight(first_dose) is None
+
+
+@pytest.mark.django_db
+def test_in_flight_claimed(event, first_dose, make_slots, locmem_cache, monkeypatch):
+    make_slots(1)
+    owners = []
+
+    def book_second_dose(**kwargs):
+        owners.append(in_flight(first_dose))
+        if len(owners) == 1:
+            # A task queued again in the meantime does not schedule the position
+            schedule_second_dose.apply(
+                args=(event.pk, first_dose.pk), task_id="second", throw=True
+            )
+        return original(**kwargs)
+
+    original = tasks.book_second_dose
+    monkeypatch.setattr(tasks, "book_second_dose", book_second_dose)
+    with scopes_disabled():
+        schedule_second_dose.apply(
+            args=(event.pk, first_dose.pk), task_id="first", throw=True
+        )
+        assert LinkedOrderPosition.objects.filter(base_position=first_dose).count() == 1
+    assert owners == ["first"]
+    assert in_flight(first_dose) is None
+
+
+@pytest.mark.django_db
+def test_batch_in_flight(event, first_dose, make_slots, make_position, locmem_cache):
+    make_slots(3)
+    queued, other = [make_position(first_dose.subevent) for i in range(2)]
+    assert tasks.claim_in_flight(queued.pk, tasks.QUEUE_OWNER)
+    assert tasks.claim_in_flight(other.pk, "other")
+
+    with scopes_disabled():
+        tasks.schedule_second_doses.apply(
+            args=(event.pk, [first_dose.pk, queued.pk, other.pk]),
+            task_id="batch",
+            throw=True,
+        )
+        assert scheduled_slot(first_dose) and scheduled_slot(queued)
+        # Positions in flight in another task are neither scheduled nor released
+        assert scheduled_slot(other) is None
+    assert in_flight(first_dose) is None
+    assert in_flight(queued) is None
+    assert in_flight(other) == "other"
@@ -0,0 +1,135 @@
+import datetime as dt
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from pretix_vacc_autosched.models import LinkedOrderPosition
+
+# Queries of a self-service booking page, independent of the number of time slots.
+# Settings and domain lookups are not counted, they are served from the cache in
+# production but not in the test settings.
+QUERY_BUDGET_GET = 14
+QUERY_BUDGET_POST = 14
+CACHED_TABLES = ("_settingsstore", "pretixmultidomain_")
+
+
+def booking_url(position):
+    order = position.order
+    return f"/{order.event.organizer.slug}/{order.event.slug}/2nd/{order.code}/"
+
+
+def count_queries(client, method, url, **kwargs):
+    with CaptureQueriesContext(connection) as ctx:
+        response = getattr(client, method)(url, **kwargs)
+    return response, len(
+        [
+            q
+            for q in ctx.captured_queries
+            if not any(t in q["sql"].split(" WHERE ")[0] for t in CACHED_TABLES)
+        ]
+    )
+
+
+@pytest.mark.django_db
+def test_booking_page_queries_constant(client, first_dose, make_slots):
+    make_slots(2)
+    client.get(booking_url(first_dose))  # warm up caches and the availability index
+    response, few = count_queries(client, "get", booking_url(first_dose))
+    assert response.status_code == 200
+
+    make_slots(20)
+    client.get(booking_url(first_dose))
+    response, many = count_queries(client, "get", booking_url(first_dose))
+    assert response.status_code == 200
+    assert b"id_subevent_" in response.content
+    assert many == few
+    assert many <= QUERY_BUDGET_GET, many
+
+
+@pytest.mark.django_db
+def test_booking_post_queries(client, first_dose, make_slots):
+    slots = make_slots(20)
+    client.get(booking_url(first_dose))
+    response, queries = count_queries(
+        client,
+        "post",
+        booking_url(first_dose),
+        data={"subevent": "invalid"},
+    )
+    assert response.status_code == 200
+    assert queries <= QUERY_BUDGET_POST, queries
+
+    response = client.post(booking_url(first_dose), data={"subevent": slots[3].pk})
+    assert response.status_code == 200
+    with scopes_disabled():
+        link = LinkedOrderPosition.objects.get(base_position=first_dose)
+        assert link.child_position.subevent == slots[3]
+
+
+@pytest.mark.django_db
+def test_slots_of_one_day(client, first_dose, make_slots):
+    slots = make_slots(30)
+    day = slots[0].date_from.date()
+    response = client.get(booking_url(first_dose) + f"slots/?date={day.isoformat()}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["date"] == day.isoformat()
+    assert [s["id"] for s in data["slots"]] == [
+        s.pk for s in slots if s.date_from.date() == day
+    ]
+
+    response = client.get(booking_url(first_dose) + "slots/?date=foo")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_booking_in_background(client, event, first_dose, make_slots):
+    event.settings.vacc_autosched_self_service_async = True
+    slots = make_slots(5)
+
+    response = client.post(booking_url(first_dose), data={"subevent": slots[1].pk})
+    assert response.status_code == 302
+    assert response["Location"].endswith(booking_url(first_dose) + "thanks/")
+    with scopes_disabled():
+        link = LinkedOrderPosition.objects.get(base_position=first_dose)
+        assert link.child_position.subevent == slots[1]
+
+    response = client.post(booking_url(first_dose), data={"subevent": slots[2].pk})
+    assert response.status_code == 302
+    assert response["Location"].endswith("/2nd")
+
+
+@pytest.mark.django_db
+def test_end_time_of_target_series(client, event, item, first_dose):
+    with scopes_disabled():
+        other = Event.objects.create(
+            organizer=event.organizer,
+            name="Second dose",
+            slug="second",
+            date_from=now(),
+            has_subevents=True,
+            live=True,
+        )
+        slot = other.subevents.create(
+            name="Slot",
+            date_from=now() + dt.timedelta(days=21),
+            date_to=now() + dt.timedelta(days=21, minutes=30),
+            active=True,
+        )
+        quota = other.quotas.create(name="Slot", size=1, subevent=slot)
+        quota.items.add(other.items.create(name="Vaccination", default_price=0))
+        config = item.vacc_autosched_config
+        config.event = other
+        config.save()
+    event.settings.show_date_to = False
+    other.settings.show_date_to = True
+
+    # The page and the slots loaded for another day show the end time alike
+    response = client.get(booking_url(first_dose))
+    day = slot.date_from.date().isoformat()
+    slots = client.get(booking_url(first_dose) + f"slots/?date={day}").json()["slots"]
+    assert slots[0]["time_to"]
+    assert f"– {slots[0]['time_to']}" in response.content.decode()
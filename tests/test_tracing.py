@@ -0,0 +1,99 @@
+import json
+import pytest
+from configparser import ConfigParser
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Checkin
+from pretix.base.signals import checkin_created
+
+from pretix_vacc_autosched import tracing
+from pretix_vacc_autosched.models import LinkedOrderPosition
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    spans = []
+    monkeypatch.setattr(tracing, "get_exporter", lambda: spans.append)
+    return spans
+
+
+@pytest.mark.django_db
+def test_trace_from_checkin_to_notification(
+    event, first_dose, make_slots, spans, django_capture_on_commit_callbacks
+):
+    event.settings.vacc_autosched_checkin = True
+    event.settings.vacc_autosched_mail = True
+    make_slots(1)
+    with scopes_disabled(), django_capture_on_commit_callbacks(execute=True):
+        checkin = Checkin.objects.create(
+            position=first_dose,
+            list=event.checkin_lists.create(name="Entry", all_products=True),
+            datetime=now(),
+        )
+        checkin_created.send(event, checkin=checkin)
+
+    by_name = {s["name"]: s for s in spans}
+    assert {s["trace"] for s in spans} == {by_name["checkin"]["trace"]}
+    assert by_name["checkin"]["parent"] is None
+    assert by_name["schedule_second_dose"]["parent"] == by_name["checkin"]["span"]
+    assert by_name["book_second_dose"]["parent"] == (
+        by_name["schedule_second_dose"]["span"]
+    )
+    assert by_name["create_order"]["parent"] == by_name["book_second_dose"]["span"]
+    assert by_name["deliver_notification"]["parent"] == (
+        by_name["book_second_dose"]["span"]
+    )
+    assert by_name["notify_email"]["parent"] == by_name["deliver_notification"]["span"]
+    # The time in the queue is recorded separately from the processing time
+    assert [s["attributes"]["task"] for s in spans if s["name"] == "queued"] == [
+        "schedule_second_dose",
+        "deliver_notification",
+    ]
+
+    with scopes_disabled():
+        link = LinkedOrderPosition.objects.get(base_position=first_dose)
+        logentry = first_dose.order.all_logentries().get(
+            action_type="pretix_vacc_autosched.scheduled"
+        )
+        assert logentry.parsed_data["trace"] == by_name["checkin"]["trace"]
+        assert not link.child_position.order.vacc_autosched_outbox.exists()
+
+
+@pytest.mark.django_db
+def test_no_trace_without_exporter(event, first_dose, make_slots, monkeypatch):
+    monkeypatch.setattr(tracing, "get_exporter", lambda: None)
+    event.settings.vacc_autosched_checkin = True
+    make_slots(1)
+    with scopes_disabled():
+        checkin = Checkin.objects.create(
+            position=first_dose,
+            list=event.checkin_lists.create(name="Entry", all_products=True),
+            datetime=now(),
+        )
+        checkin_created.send(event, checkin=checkin)
+        logentry = first_dose.order.all_logentries().get(
+            action_type="pretix_vacc_autosched.scheduled"
+        )
+        assert "trace" not in logentry.parsed_data
+
+
+def test_json_lines_exporter(settings, tmp_path):
+    config = ConfigParser()
+    config.read_dict({"vacc_autosched": {"trace_file": str(tmp_path / "traces.jsonl")}})
+    settings.CONFIG_FILE = config
+    tracing.get_exporter.cache_clear()
+    try:
+        with tracing.start_trace("root", order="ABC12"):
+            with tracing.span("child"):
+                pass
+    finally:
+        tracing.get_exporter.cache_clear()
+
+    child, root = [
+        json.loads(line)
+        for line in (tmp_path / "traces.jsonl").read_text().splitlines()
+    ]
+    assert child["parent"] == root["span"]
+    assert child["trace"] == root["trace"]
+    assert root["attributes"] == {"order": "ABC12"}
+    assert root["start"] <= child["start"] <= child["end"] <= root["end"]
@@ -0,0 +1,64 @@
+import pytest
+from django.core.cache import cache
+from django.test import Client
+from types import SimpleNamespace
+
+from pretix_vacc_autosched import waitingroom
+
+WAITING = b"Your position in the queue"
+
+
+@pytest.fixture
+def clock(settings, monkeypatch):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(waitingroom, "time", SimpleNamespace(time=lambda: clock.now))
+    yield clock
+    cache.clear()
+
+
+def index_url(event):
+    return f"/{event.organizer.slug}/{event.slug}/2nd/"
+
+
+def queue_position(client, event):
+    return client.get(index_url(event) + "queue/").json()["position"]
+
+
+@pytest.mark.django_db
+def test_visitors_admitted_at_rate(event, clock):
+    event.settings.vacc_autosched_waiting_room_rate = 2
+    visitors = [Client() for i in range(5)]
+
+    # One second of admissions is let in right away, everyone else waits in line
+    assert [WAITING in v.get(index_url(event)).content for v in visitors] == [
+        False,
+        False,
+        True,
+        True,
+        True,
+    ]
+    assert [queue_position(v, event) for v in visitors] == [0, 0, 1, 2, 3]
+
+    clock.now += 1
+    assert [queue_position(v, event) for v in visitors] == [0, 0, 0, 0, 1]
+    assert WAITING not in visitors[2].get(index_url(event)).content
+
+    # Admitted visitors stay admitted, a new visitor queues behind the others
+    assert WAITING not in visitors[0].get(index_url(event)).content
+    assert WAITING in Client().get(index_url(event)).content
+
+
+@pytest.mark.django_db
+def test_forged_ticket_gets_new_number(client, event, clock):
+    event.settings.vacc_autosched_waiting_room_rate = 1
+    assert WAITING not in client.get(index_url(event)).content
+
+    client.cookies[f"vacc_autosched_queue_{event.pk}"] = "forged"
+    assert WAITING in client.get(index_url(event)).content
+    assert queue_position(client, event) == 1
+
+    response = Client().get(index_url(event) + "queue/")
+    assert response.status_code == 400